@@ -1,8 +1,10 @@
 import os
+import io
 import asyncio
 import sys
 import getpass
-from typing import List, Set
+from typing import Iterator, List, Optional, Set
+from uuid import uuid4
 
 import discord
 from discord import app_commands
@@ -10,13 +12,35 @@ from discord.ext import commands
 from dotenv import load_dotenv
 import sqlite3
 import time
+import calendar
 import random
 import math
+import atexit
 import logging
+import logging.handlers
+import queue
+import re
 import shutil
+import tempfile
+import functools
+import itertools
+import colorsys
+import contextlib
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import date, datetime, timedelta
 
+# Pillow is optional: without it the bot falls back to text-only output
+try:
+    from PIL import Image, ImageDraw, ImageFont
+    _PIL_OK = True
+except Exception:
+    Image = ImageDraw = ImageFont = None
+    _PIL_OK = False
+
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
 if TOKEN:
@@ -26,6 +50,43 @@ APPLICATION_ID = os.getenv("APPLICATION_ID")
 PUBLIC_KEY = os.getenv("PUBLIC_KEY")
 BOT_PERMISSIONS = os.getenv("BOT_PERMISSIONS", "3941734153713728")
 
+
+def save_token_to_env(token: str) -> None:
+    """Write or update DISCORD_TOKEN in the project's .env file.
+
+    The file is streamed line by line into a temp file in the same directory and
+    swapped in with os.replace, so a crash mid-write never leaves a truncated .env.
+    """
+    env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+    token_line = f"DISCORD_TOKEN={token}\n"
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            "w", dir=os.path.dirname(env_path), prefix=".env.", delete=False
+        ) as tmp:
+            tmp_path = tmp.name
+            wrote = False
+            if os.path.exists(env_path):
+                with open(env_path, "r") as f:
+                    for line in f:
+                        # replace the first DISCORD_TOKEN line, keep everything else as-is
+                        if not wrote and line.strip().startswith("DISCORD_TOKEN="):
+                            tmp.write(token_line)
+                            wrote = True
+                            continue
+                        if not line.endswith("\n"):
+                            line += "\n"
+                        tmp.write(line)
+            if not wrote:
+                tmp.write(token_line)
+        os.replace(tmp_path, env_path)
+        print(f"Saved token to {env_path}.")
+    except Exception as e:
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        print("Failed to save .env file:", e)
+
+
 # If no token found in environment, and we're in an interactive terminal, prompt the user
 if not TOKEN:
     # Only prompt when running interactively
@@ -37,30 +98,7 @@ if not TOKEN:
         except Exception:
             entered = None
         if entered:
-            # write or update .env in project root
-            env_path = os.path.join(os.path.dirname(__file__), ".env")
-            lines = []
-            if os.path.exists(env_path):
-                try:
-                    with open(env_path, "r") as f:
-                        lines = f.readlines()
-                except Exception:
-                    lines = []
-            # update existing DISCORD_TOKEN line if present
-            updated = False
-            for i, line in enumerate(lines):
-                if line.strip().startswith("DISCORD_TOKEN="):
-                    lines[i] = f"DISCORD_TOKEN={entered.strip()}\n"
-                    updated = True
-                    break
-            if not updated:
-                lines.append(f"DISCORD_TOKEN={entered.strip()}\n")
-            try:
-                with open(env_path, "w") as f:
-                    f.writelines(lines)
-                print(f"Saved token to {env_path}.")
-            except Exception as e:
-                print("Failed to save .env file:", e)
+            save_token_to_env(entered.strip())
             TOKEN = entered
         else:
             print("No token entered. Exiting.")
@@ -71,11 +109,35 @@ if not TOKEN:
 
 intents = discord.Intents.default()
 intents.message_content = True
+# members intent keeps the member cache populated so guild.get_member hits instead of
+# falling back to a rate-limited fetch_member REST call (enable "Server Members Intent"
+# for the application in the Developer Portal)
+intents.members = True
 
 bot = commands.Bot(command_prefix="!", intents=intents)
 
 # Basic logging so we can see exceptions in hosted environments (Railway etc.)
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(name)s: %(message)s')
+# Records are only queued on the calling thread; a listener thread formats and writes them, so a
+# slow stdout (container log drivers) never stalls the event loop.
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that skips the stock prepare(), which formats the message and traceback on
+    the caller. The queue stays in-process, so the record goes through untouched and the
+    listener's handlers format it on their own thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+logging.getLogger().handlers = [_DeferredQueueHandler(_log_queue)]
+_log_listener.start()
+# flush whatever is still queued on the way out
+atexit.register(_log_listener.stop)
 
 
 # helper to run tasks safely and log uncaught exceptions
@@ -83,19 +145,81 @@ async def run_coro_safe(coro, name: str | None = None):
     try:
         await coro
     except Exception:
-        logging.exception(f"Uncaught exception in background task {name}")
+        logging.exception("Uncaught exception in background task %s", name)
+
+
+async def send_with_retry(dest: discord.abc.Messageable, *args, retries: int = 3, **kwargs):
+    """dest.send(...) that waits out a 429 (retry_after) and tries again instead of dropping the message."""
+    for attempt in range(retries):
+        try:
+            return await dest.send(*args, **kwargs)
+        except discord.HTTPException as e:
+            if e.status != 429 or attempt == retries - 1:
+                raise
+            await asyncio.sleep(getattr(e, "retry_after", None) or 1.0)
+            # an attachment's file pointer was consumed by the failed attempt
+            if kwargs.get("file") is not None:
+                kwargs["file"].reset()
+
+
+async def sync_with_backoff(guild: discord.abc.Snowflake | None = None, max_retries: int = 5):
+    """bot.tree.sync(guild=...) that waits out a 429 with exponential backoff (plus jitter)
+    instead of leaving the command tree unregistered.
+    """
+    for attempt in range(max_retries):
+        try:
+            return await bot.tree.sync(guild=guild)
+        except discord.HTTPException as e:
+            if e.status != 429 or attempt == max_retries - 1:
+                raise
+            await asyncio.sleep((getattr(e, "retry_after", None) or 1.0) * 2 ** attempt + random.uniform(0, 0.5))
+
+
+# Channel housekeeping (deleting channels, editing overwrites) is queued for a few worker tasks
+# so interactions answer right away; a 429 puts the job back after an exponential backoff.
+DISCORD_JOB_WORKERS = 4
+# (coroutine factory, attempt, name); created in on_ready together with the workers
+_discord_job_q: asyncio.Queue | None = None
+_discord_job_workers: list[asyncio.Task] = []
+
+
+def queue_discord_job(factory, name: str = "discord-job"):
+    """Run factory() (which returns a coroutine) on the job workers. Before the workers
+    exist it just runs as a background task.
+    """
+    if _discord_job_q is None:
+        asyncio.ensure_future(run_coro_safe(factory(), name=name))
+        return
+    _discord_job_q.put_nowait((factory, 0, name))
+
+
+async def _discord_job_worker(retries: int = 3):
+    while True:
+        factory, attempt, name = await _discord_job_q.get()
+        try:
+            await factory()
+        except discord.HTTPException as e:
+            if e.status == 429 and attempt < retries:
+                await asyncio.sleep((getattr(e, "retry_after", None) or 1.0) * 2 ** attempt)
+                _discord_job_q.put_nowait((factory, attempt + 1, name))
+            else:
+                logging.warning("%s failed: %s", name, e)
+        except Exception as e:
+            logging.warning("%s failed: %s", name, e)
+        finally:
+            _discord_job_q.task_done()
 
 
 @bot.event
 async def on_ready():
     try:
-        logging.info(f"Bot ready. Logged in as: {bot.user} (id={getattr(bot.user, 'id', None)})")
+        logging.info("Bot ready. Logged in as: %s (id=%s)", bot.user, getattr(bot.user, 'id', None))
         # attempt to sync commands and log the count
         try:
-            synced = await bot.tree.sync()
-            logging.info(f"Synced {len(synced)} application commands")
+            synced = await sync_with_backoff()
+            logging.info("Synced %d application commands", len(synced))
         except Exception as e:
-            logging.warning(f"Failed to sync commands: {e}")
+            logging.warning("Failed to sync commands: %s", e)
     except Exception:
         logging.exception("Exception in on_ready")
 
@@ -103,76 +227,90 @@ async def on_ready():
 class WordChainGame:
     def __init__(self, channel: discord.TextChannel, starter: str | None = None, turn_timeout: int = 15):
         self.channel = channel
-        self.players: list[int] = []  # join order
-        self.lives: dict[int, int] = {}  # user_id -> lives
+        # user_id -> lives, in join order; doubles as the O(1) membership check
+        self.lives: dict[int, int] = {}
         self.used_words: set[str] = set()
-        self.current_word: str | None = starter
-        self.current_player_idx: int = 0
+        self.current_word: str | None = normalize_word(starter) if starter else None
+        # alive players in turn order; the front is whoever plays next
+        self._alive_q: deque[int] = deque()
         self.turn_timeout = turn_timeout
         self.lock = asyncio.Lock()
         self.started = False
         self._turn_task: asyncio.Task | None = None
-        # message id of the lobby message (so we can edit it to show current players)
-        self.lobby_message_id: int | None = None
+        # the current player's messages, fed by the shared _wordchain_on_message listener
+        self._turn_queue: asyncio.Queue[discord.Message] = asyncio.Queue()
+        # the lobby message itself (kept so join/leave/start can edit it without re-fetching)
+        self.lobby_message: discord.Message | None = None
+        # pending debounced lobby edit, see schedule_lobby_update
+        self._lobby_update_task: asyncio.Task | None = None
 
     def add_player(self, user_id: int) -> bool:
         if self.started:
             return False
-        if user_id in self.players:
+        if user_id in self.lives:
             return False
-        self.players.append(user_id)
         self.lives[user_id] = 3
+        self._alive_q.append(user_id)
         return True
 
     def remove_player(self, user_id: int) -> bool:
-        if user_id in self.players:
-            self.players.remove(user_id)
-            self.lives.pop(user_id, None)
+        if self.lives.pop(user_id, None) is not None:
+            try:
+                self._alive_q.remove(user_id)
+            except ValueError:
+                pass
             return True
         return False
 
     def next_player_id(self) -> int | None:
-        if not self.players:
-            return None
-        # advance to next alive player
-        starting_idx = self.current_player_idx % len(self.players)
-        for i in range(len(self.players)):
-            idx = (starting_idx + i) % len(self.players)
-            uid = self.players[idx]
-            if self.lives.get(uid, 0) > 0:
-                self.current_player_idx = idx
-                return uid
-        return None
+        return self._alive_q[0] if self._alive_q else None
+
+    def advance_turn(self, user_id: int):
+        """Pass the turn on from user_id (no-op if they were just eliminated)."""
+        if self._alive_q and self._alive_q[0] == user_id:
+            self._alive_q.rotate(-1)
+
+    def lose_life(self, user_id: int) -> int:
+        """Take one life from user_id, dropping them from the turn order at 0. Returns lives left."""
+        if user_id not in self.lives:
+            return 0
+        left = max(0, self.lives[user_id] - 1)
+        self.lives[user_id] = left
+        if left == 0:
+            try:
+                self._alive_q.remove(user_id)
+            except ValueError:
+                pass
+        return left
 
     def eliminate_if_needed(self, user_id: int):
-        if self.lives.get(user_id, 0) <= 0 and user_id in self.players:
+        if self.lives.get(user_id, 1) <= 0:
             # keep in list but effectively skipped; winner determination checks lives
             return True
         return False
 
     def alive_players(self) -> list[int]:
-        return [uid for uid in self.players if self.lives.get(uid, 0) > 0]
+        return list(self._alive_q)
 
     def is_word_valid(self, word: str) -> bool:
         # basic validation: alphabetical and not used
-        if not word or not any(c.isalpha() for c in word):
-            return False
-        w = normalize_word(word)
-        if w in self.used_words:
+        return self._is_normalized_valid(normalize_word(word))
+
+    def _is_normalized_valid(self, w: str) -> bool:
+        if not w or w in self.used_words:
             return False
         if self.current_word:
-            # must start with last letter of current_word
-            last = normalize_word(self.current_word)[-1]
-            return w[0] == last
+            # must start with last letter of current_word (already normalized)
+            return w[0] == self.current_word[-1]
         return True
 
     def play_word(self, user_id: int, word: str) -> tuple[bool, str]:
-        # returns (accepted, message)
+        # returns (accepted, message); on success current_word holds the normalized word
         w = normalize_word(word)
-        if not self.is_word_valid(word):
+        if not self._is_normalized_valid(w):
             # lose a life
-            self.lives[user_id] = max(0, self.lives.get(user_id, 0) - 1)
-            return False, f"Invalid word. <@{user_id}> loses 1 life (now {self.lives[user_id]})."
+            left = self.lose_life(user_id)
+            return False, f"Invalid word. <@{user_id}> loses 1 life (now {left})."
         # accept
         self.used_words.add(w)
         self.current_word = w
@@ -180,29 +318,67 @@ class WordChainGame:
 
     def format_lobby(self) -> str:
         """Return a short text listing current players and their lives for lobby feedback."""
-        if not self.players:
+        if not self.lives:
             return "No players yet. Click Join to participate."
         lines: list[str] = []
-        for idx, uid in enumerate(self.players, start=1):
-            lives = self.lives.get(uid, 0)
+        for idx, (uid, lives) in enumerate(self.lives.items(), start=1):
             lines.append(f"{idx}. <@{uid}> — {lives} lives")
         return "\n".join(lines)
 
 
+# compiled once: drops everything that isn't a word character, apostrophe or hyphen, plus
+# digits/underscores. \w still lets non-decimal numerics (², Ⅻ) through; see normalize_word
+_WORD_DROP_RE = re.compile(r"[^\w'-]|[\d_]")
+
+
 def normalize_word(w: str) -> str:
-    # Lowercase, strip punctuation except internal apostrophes/hyphens
-    w = w.strip().lower()
-    # remove surrounding non-alpha
-    filtered = ''.join(ch for ch in w if ch.isalpha() or ch in "'-")
-    # if result empty fallback to original letters only
-    if not any(c.isalpha() for c in filtered):
-        filtered = ''.join(c for c in w if c.isalpha())
+    # Lowercase, keep letters plus internal apostrophes/hyphens
+    filtered = _WORD_DROP_RE.sub("", w.strip().lower())
+    if not filtered.replace("'", "").replace("-", "").isalpha():
+        # rare: a numeric \w survived the regex (or nothing but '/- is left); filter per char
+        filtered = "".join(ch for ch in filtered if ch.isalpha() or ch in "'-")
+        # apostrophes/hyphens alone don't make a word
+        if not any(ch.isalpha() for ch in filtered):
+            return ""
     return filtered
 
 # Active games per channel_id
 wordchain_games: dict[int, WordChainGame] = {}
 
 
+@bot.listen("on_message")
+async def _wordchain_on_message(message: discord.Message):
+    """Route a message to its channel's running game if it's from the player whose turn it is.
+    One dict lookup per message instead of a wait_for check per game per message.
+    """
+    game = wordchain_games.get(message.channel.id)
+    if game is None or not game.started:
+        return
+    if message.author.id == game.next_player_id():
+        game._turn_queue.put_nowait(message)
+
+# join/leave spam is coalesced into one lobby edit per quiet period
+LOBBY_EDIT_DEBOUNCE = 0.5  # seconds
+
+
+def schedule_lobby_update(game: WordChainGame, view: discord.ui.View):
+    """Edit the lobby message once things go quiet; each call pushes the edit back."""
+    if game._lobby_update_task and not game._lobby_update_task.done():
+        game._lobby_update_task.cancel()
+    game._lobby_update_task = asyncio.create_task(_lobby_update_after_delay(game, view))
+
+
+async def _lobby_update_after_delay(game: WordChainGame, view: discord.ui.View):
+    await asyncio.sleep(LOBBY_EDIT_DEBOUNCE)
+    if game.started or not game.lobby_message:
+        return
+    try:
+        new_content = f"Word Chain lobby (host and players below):\n\n{game.format_lobby()}"
+        await game.lobby_message.edit(content=new_content, view=view)
+    except Exception:
+        pass
+
+
 class WordChainView(discord.ui.View):
     def __init__(self, channel_id: int):
         super().__init__(timeout=None)
@@ -220,13 +396,7 @@ class WordChainView(discord.ui.View):
             return
         await interaction.response.send_message(f"{interaction.user.mention} joined the lobby. Lives: 3", ephemeral=True)
         # update lobby message with current players
-        if game.lobby_message_id and interaction.channel:
-            try:
-                lobby_msg = await interaction.channel.fetch_message(game.lobby_message_id)
-                new_content = f"Word Chain lobby (host and players below):\n\n{game.format_lobby()}"
-                await lobby_msg.edit(content=new_content, view=self)
-            except Exception:
-                pass
+        schedule_lobby_update(game, self)
 
     @discord.ui.button(label="Leave", style=discord.ButtonStyle.danger)
     async def leave(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -238,13 +408,7 @@ class WordChainView(discord.ui.View):
         if removed:
             await interaction.response.send_message("You left the lobby.", ephemeral=True)
             # update lobby message
-            if game.lobby_message_id and interaction.channel:
-                try:
-                    lobby_msg = await interaction.channel.fetch_message(game.lobby_message_id)
-                    new_content = f"Word Chain lobby (host and players below):\n\n{game.format_lobby()}"
-                    await lobby_msg.edit(content=new_content, view=self)
-                except Exception:
-                    pass
+            schedule_lobby_update(game, self)
         else:
             await interaction.response.send_message("You are not in the lobby.", ephemeral=True)
 
@@ -257,22 +421,24 @@ class WordChainView(discord.ui.View):
         if game.started:
             await interaction.response.send_message("Game already started.", ephemeral=True)
             return
-        if len(game.players) < 2:
+        if len(game.lives) < 2:
             await interaction.response.send_message("Need at least 2 players to start.", ephemeral=True)
             return
         game.started = True
+        # the started message below supersedes any pending lobby edit
+        if game._lobby_update_task and not game._lobby_update_task.done():
+            game._lobby_update_task.cancel()
         await interaction.response.send_message("Game started! Play by sending words in this channel. You have 3 lives. Good luck!", ephemeral=False)
         # update lobby message to indicate game started and remove the view (disable buttons)
-        if game.lobby_message_id and interaction.channel:
+        if game.lobby_message:
             try:
-                lobby_msg = await interaction.channel.fetch_message(game.lobby_message_id)
                 # stop the view to prevent further interactions
                 try:
                     self.stop()
                 except Exception:
                     pass
                 new_content = f"Word Chain — GAME STARTED!\n\nPlayers:\n{game.format_lobby()}"
-                await lobby_msg.edit(content=new_content, view=None)
+                await game.lobby_message.edit(content=new_content, view=None)
             except Exception:
                 pass
         # begin turn loop
@@ -284,13 +450,11 @@ async def run_wordchain_game(game: WordChainGame):
     channel = game.channel
     # Announce game start and ghosts award (100% probability)
     try:
-        participants_total = len(game.players)
+        participants_total = len(game.lives)
         ghosts_awarded = max(1, 2 * participants_total)
         await channel.send(f"Word Chain: the game is live! The first player will be chosen from the lobby. Winner will receive {GHOST_EMOJI} {ghosts_awarded}.")
     except Exception:
         await channel.send("Word Chain: the game is live! The first player will be chosen from the lobby.")
-    # pick starting player index 0
-    game.current_player_idx = 0
     # if no starter word, request first word from first player
     while True:
         alive = game.alive_players()
@@ -300,29 +464,29 @@ async def run_wordchain_game(game: WordChainGame):
         if uid is None:
             break
         member_mention = f"<@{uid}>"
+        # drop anything that arrived between turns; like wait_for, only messages sent after the prompt count
+        while not game._turn_queue.empty():
+            game._turn_queue.get_nowait()
         try:
             await channel.send(f"{member_mention}, it's your turn! You have {game.turn_timeout} seconds. Current word: {game.current_word or '(none)'}")
         except Exception:
             pass
 
-        # wait for message from that user
-        def check(m: discord.Message):
-            return m.author.id == uid and m.channel.id == channel.id
-
+        # wait for a message from that user (the listener only queues the current player's)
         try:
-            msg = await bot.wait_for('message', timeout=game.turn_timeout, check=check)
+            msg = await asyncio.wait_for(game._turn_queue.get(), timeout=game.turn_timeout)
         except asyncio.TimeoutError:
             # lose a life
-            game.lives[uid] = max(0, game.lives.get(uid, 0) - 1)
-            await channel.send(f"Time's up! <@{uid}> loses 1 life (now {game.lives[uid]}).")
-            # advance index to next player
-            game.current_player_idx = (game.current_player_idx + 1) % max(1, len(game.players))
+            left = game.lose_life(uid)
+            await channel.send(f"Time's up! <@{uid}> loses 1 life (now {left}).")
+            # advance to next player
+            game.advance_turn(uid)
             continue
 
         word = msg.content.strip()
         accepted, text = game.play_word(uid, word)
         if accepted:
-            await channel.send(f"{member_mention} played **{normalize_word(word)}**.")
+            await channel.send(f"{member_mention} played **{game.current_word}**.")
         else:
             await channel.send(text)
         # check eliminated
@@ -330,13 +494,13 @@ async def run_wordchain_game(game: WordChainGame):
         if len(alive_after) <= 1:
             break
         # advance to next player
-        game.current_player_idx = (game.current_player_idx + 1) % max(1, len(game.players))
+        game.advance_turn(uid)
 
     # announce winner and award ghosts (always)
     survivors = game.alive_players()
     if survivors:
         winner = survivors[0]
-        participants_total = len(game.players)
+        participants_total = len(game.lives)
         ghosts_awarded = max(1, 2 * participants_total)
         try:
             guild = channel.guild if hasattr(channel, 'guild') else None
@@ -346,7 +510,7 @@ async def run_wordchain_game(game: WordChainGame):
                 except Exception:
                     pass
             else:
-                add_ghosts(winner, ghosts_awarded)
+                await run_db(add_ghosts, winner, ghosts_awarded)
                 try:
                     await channel.send(f"Game over! Winner is <@{winner}> 🎉 — Congrats! You've won {GHOST_EMOJI} {ghosts_awarded}.")
                 except Exception:
@@ -382,21 +546,21 @@ async def slash_wordchain(interaction: discord.Interaction, timeout: int = 15):
     view = WordChainView(channel_id=channel.id)
     # add host as first player automatically
     game.add_player(interaction.user.id)
-    # send lobby message and remember its id so we can edit it on join/leave
+    # send lobby message and remember it so we can edit it on join/leave
     lobby_content = f"Word Chain lobby created by {interaction.user.mention}! Click Join to participate. Turn timeout: {timeout}s. Host auto-joined.\n\nPlayers:\n{game.format_lobby()}"
     resp = await interaction.response.send_message(lobby_content, view=view)
-    # when using response.send_message, the returned object isn't the message; fetch it from the channel
+    # when using response.send_message, the returned object isn't the message; fetch it once
+    # from the channel and keep it on the game (a channel message stays editable after the
+    # interaction token expires, unlike the interaction's original response)
     try:
-        # followup fetch: the response message should be visible to the invoking user; try to get last message in channel from bot
         sent = await channel.fetch_message((await interaction.original_response()).id)
-        game.lobby_message_id = sent.id
+        game.lobby_message = sent
     except Exception:
-        # best-effort: try to set lobby_message_id via the interaction response message
+        # best-effort: fall back to the interaction response message
         try:
-            orig = await interaction.original_response()
-            game.lobby_message_id = orig.id
+            game.lobby_message = await interaction.original_response()
         except Exception:
-            game.lobby_message_id = None
+            game.lobby_message = None
 
         # Help commands were previously defined inside the exception block above which
         # prevented them from being registered at module import time. Define them at
@@ -419,14 +583,45 @@ if APPLICATION_ID:
 # APPLICATION_ID=1424779352008298537
 # PUBLIC_KEY=68188c9db80ddaa08f7b6540149c93bf4cfae9e38361018a093e245cd7db71f9
 
-# In-memory storage mapping message_id -> set of user ids
-tournaments: dict[int, Set[int]] = {}
-# Additional metadata: map message_id -> dict with 'start' timestamp and 'host'
-tournaments_meta: dict[int, dict] = {}
+@dataclass
+class Lobby:
+    """State for one tournament lobby (keyed by its message id in `lobbies`)."""
+    participants: dict[int, None] = field(default_factory=dict)  # join order, used as an ordered set
+    max_participants: int = 50
+    start: float = 0  # unix timestamp the lobby was opened (0 = unknown)
+    host: int | None = None
+    base_description: str | None = None  # embed text the participant list is appended to
+    image_map: dict[int, str | None] = field(default_factory=dict)
+    asset_iter: Iterator[str] | None = None  # shuffled asset deck, see _next_asset
+
+    def try_add(self, user_id: int) -> str:
+        """Check the cap and add user_id in one step. Returns "joined", "already" or "full".
+        There's no await between the check and the add, so concurrent joins can't overshoot the cap.
+        """
+        if user_id in self.participants:
+            return "already"
+        if len(self.participants) >= self.max_participants:
+            return "full"
+        self.participants[user_id] = None
+        return "joined"
+
+
+# In-memory storage mapping message_id -> Lobby
+lobbies: dict[int, Lobby] = {}
+
+
+def get_lobby(msg_id: int) -> Lobby:
+    """Return the lobby for msg_id, creating an empty one (e.g. for a view that outlived a restart)."""
+    lobby = lobbies.get(msg_id)
+    if lobby is None:
+        lobby = lobbies[msg_id] = Lobby()
+    return lobby
 
 # In-memory storage for wheels (reaction-based roulette)
 wheels: dict[int, Set[int]] = {}
 wheels_meta: dict[int, dict] = {}
+# (channel_id, host_id) -> message id of that host's latest wheel in the channel
+_host_wheels: dict[tuple[int, int], int] = {}
 
 # SQLite for simple stats: wins per user (global) and per guild
 # Path to SQLite DB. Allow overriding via environment variable FURBY_DB_PATH.
@@ -453,17 +648,57 @@ try:
     if os.path.exists(repo_local_db) and not os.path.exists(DB_PATH):
         try:
             shutil.copy2(repo_local_db, DB_PATH)
-            logging.info(f"Migrated existing DB from {repo_local_db} to {DB_PATH}")
+            logging.info("Migrated existing DB from %s to %s", repo_local_db, DB_PATH)
         except Exception as e:
-            logging.warning(f"Failed to migrate DB from {repo_local_db} to {DB_PATH}: {e}")
-    logging.info(f"Using DB at: {DB_PATH}")
+            logging.warning("Failed to migrate DB from %s to %s: %s", repo_local_db, DB_PATH, e)
+    logging.info("Using DB at: %s", DB_PATH)
 except Exception:
     # best-effort only; any failures shouldn't prevent the bot from running
     pass
 
+# One long-lived connection for the whole process instead of connect()/close() per query.
+# It is in autocommit mode (isolation_level=None); multi-statement writes ask db_cursor for
+# an explicit transaction. At runtime every query goes through run_db, so only the DB thread
+# uses it; init_db at startup and optimize_db at shutdown are the only direct callers, and
+# _db_lock keeps those from overlapping with the DB thread.
+_db_conn: sqlite3.Connection | None = None
+_db_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def db_cursor(transaction: bool = False):
+    """Yield a cursor on the shared connection while holding _db_lock.
+    With transaction=True the block runs in BEGIN IMMEDIATE ... COMMIT (rolled back on error).
+    """
+    with _db_lock:
+        cur = _db_conn.cursor()
+        try:
+            if transaction:
+                cur.execute("BEGIN IMMEDIATE")
+                try:
+                    yield cur
+                except BaseException:
+                    cur.execute("ROLLBACK")
+                    raise
+                cur.execute("COMMIT")
+            else:
+                yield cur
+        finally:
+            cur.close()
+
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    global _db_conn
+    if _db_conn is None:
+        # larger statement cache so every helper's SQL stays prepared on the shared connection
+        _db_conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=256)
+    conn = _db_conn
     cur = conn.cursor()
+    # WAL lets readers proceed while a write is committing and makes commits cheaper;
+    # with WAL, synchronous=NORMAL only syncs at checkpoints and stays corruption-safe
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA temp_store=MEMORY")
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS wins_global (
@@ -542,136 +777,402 @@ def init_db():
         )
         """
     )
-    conn.commit()
-    conn.close()
+    cur.close()
 
 init_db()
 
+# All SQLite helpers below are blocking. Async handlers must go through run_db so the
+# commit/fsync happens on a dedicated thread instead of stalling the event loop. A single
+# worker keeps SQLite's single-writer model intact.
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="furby-db")
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking DB helper on the DB thread and return its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(func, *args, **kwargs))
+
+
+def optimize_db():
+    """Let SQLite refresh query-planner stats that have gone stale (a no-op when they're fresh)."""
+    try:
+        with db_cursor() as cur:
+            cur.execute("PRAGMA optimize")
+    except Exception:
+        logging.exception("PRAGMA optimize failed")
+
+
+DB_OPTIMIZE_INTERVAL = 24 * 60 * 60  # seconds
+_db_optimize_task: asyncio.Task | None = None
+
+
+async def _daily_db_optimize():
+    while True:
+        await asyncio.sleep(DB_OPTIMIZE_INTERVAL)
+        await run_db(optimize_db)
+
+
+@bot.listen("on_disconnect")
+async def _optimize_db_on_disconnect():
+    await run_db(optimize_db)
+
 # Load available furby images (assets)
 FURBY_ASSETS_DIR = os.path.join(os.path.dirname(__file__), "assets", "furbys")
-def load_furby_images():
-    if not os.path.isdir(FURBY_ASSETS_DIR):
-        return []
-    files = [os.path.join(FURBY_ASSETS_DIR, f) for f in os.listdir(FURBY_ASSETS_DIR) if f.lower().endswith((".png", ".jpg", ".jpeg", ".gif"))]
+FURBY_IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".gif")
+# (directory mtime_ns, files): the listing is only rebuilt when the directory changes
+_furby_images_cache: tuple[int, tuple[str, ...]] | None = None
+
+
+def load_furby_images() -> tuple[str, ...]:
+    """Paths of the furby asset images. A cache hit costs one stat() and hands back the
+    shared (immutable) tuple without copying it.
+    """
+    global _furby_images_cache
+    try:
+        mtime = os.stat(FURBY_ASSETS_DIR).st_mtime_ns
+    except OSError:
+        return ()
+    if _furby_images_cache and _furby_images_cache[0] == mtime:
+        return _furby_images_cache[1]
+    with os.scandir(FURBY_ASSETS_DIR) as it:
+        files = tuple(e.path for e in it if e.name.lower().endswith(FURBY_IMAGE_EXTS) and e.is_file())
+    _furby_images_cache = (mtime, files)
     return files
 
-furby_image_files = load_furby_images()
 
-def ensure_participant_images(msg_id: int, participants: list[int]):
-    """Ensure each participant has an assigned image file. Returns a dict user_id -> image_path."""
-    meta = tournaments_meta.setdefault(msg_id, {})
-    image_map = meta.get("image_map") or {}
+def _remember_furby_image(path: str):
+    """Add a freshly written asset to the cached listing instead of re-listing the directory."""
+    global _furby_images_cache
+    try:
+        mtime = os.stat(FURBY_ASSETS_DIR).st_mtime_ns
+    except OSError:
+        return
+    files = _furby_images_cache[1] if _furby_images_cache else load_furby_images()
+    if path not in files:
+        files += (path,)
+    _furby_images_cache = (mtime, files)
+
+
+@functools.lru_cache(maxsize=32)
+def _get_font(size: int, path: str = "DejaVuSans-Bold.ttf"):
+    """Load a TrueType font once per (size, path); falls back to Pillow's default font."""
+    try:
+        return ImageFont.truetype(path, size)
+    except Exception:
+        return ImageFont.load_default()
+
+
+@functools.lru_cache(maxsize=1024)
+def _text_size(font, text: str) -> tuple[int, int]:
+    """(width, height) of text in font, remembered per (font, text). Fonts come from
+    _get_font, so the same object is passed for the same font.
+    """
+    # prefer font.getbbox, fall back to the older font.getsize
+    try:
+        bbox = font.getbbox(text)
+        return bbox[2] - bbox[0], bbox[3] - bbox[1]
+    except Exception:
+        try:
+            return font.getsize(text)
+        except Exception:
+            return (0, 0)
+
+# Placeholder furby geometry (400x400 canvas) and label font, computed once at import
+_PLACEHOLDER_SIZE = 400
+_PLACEHOLDER_EYES = ((70, 90, 130, 150), (270, 90, 330, 150))
+_PLACEHOLDER_PUPILS = ((100, 120, 130, 150), (300, 120, 330, 150))
+_FURBY_FONT = None
+# eyes rasterized once on a transparent layer; each placeholder just composites it
+_PLACEHOLDER_FACE = None
+if _PIL_OK:
+    _FURBY_FONT = _get_font(28)
+    _PLACEHOLDER_FACE = Image.new("RGBA", (_PLACEHOLDER_SIZE, _PLACEHOLDER_SIZE), (0, 0, 0, 0))
+    _face_draw = ImageDraw.Draw(_PLACEHOLDER_FACE)
+    for _box in _PLACEHOLDER_EYES:
+        _face_draw.ellipse(_box, fill=(255,255,255))
+    for _box in _PLACEHOLDER_PUPILS:
+        _face_draw.ellipse(_box, fill=(0,0,0))
+    del _face_draw, _box
+
+def _next_asset(lobby: Lobby, assets: tuple[str, ...]) -> str | None:
+    """Deal assets from a per-tournament shuffled deck, reshuffling when it runs out."""
+    if not assets:
+        return None
+    chosen = next(lobby.asset_iter or iter(()), None)
+    if chosen is None:
+        pool = list(assets)
+        random.shuffle(pool)
+        lobby.asset_iter = iter(pool)
+        chosen = next(lobby.asset_iter)
+    return chosen
+
+
+def _render_placeholder(uid: int) -> str | None:
+    """Draw and save a placeholder image for uid. Blocking (PNG encode + write): run it in an executor."""
+    img = Image.new("RGBA", (_PLACEHOLDER_SIZE, _PLACEHOLDER_SIZE), tuple([random.randint(100, 255) for _ in range(3)]))
+    img.alpha_composite(_PLACEHOLDER_FACE)
+    draw = ImageDraw.Draw(img)
+    font = _FURBY_FONT
+    label = f"F-{str(uid)[-4:]}"
+    w, _ = _text_size(font, label)
+    draw.text(((_PLACEHOLDER_SIZE-w)/2, 320), label, fill=(0,0,0), font=font)
+    out_path = os.path.join(FURBY_ASSETS_DIR, f"furby_user_{uid}.png")
+    try:
+        os.makedirs(FURBY_ASSETS_DIR, exist_ok=True)
+        img.save(out_path)
+        return out_path
+    except Exception:
+        return None
+
+
+def _read_image_files(paths) -> dict[str, bytes]:
+    """Read each image path into memory (unreadable/missing paths are skipped). Blocking."""
+    data: dict[str, bytes] = {}
+    for path in paths:
+        if not path:
+            continue
+        try:
+            data[path] = Path(path).read_bytes()
+        except Exception:
+            pass
+    return data
+
+
+async def ensure_participant_images(msg_id: int, participants: list[int]):
+    """Ensure each participant has an assigned image file. Returns a dict user_id -> image_path.
+    Placeholders are rendered and saved off the event loop.
+    """
+    lobby = get_lobby(msg_id)
+    image_map = lobby.image_map
     # refresh available assets
     assets = load_furby_images()
     # assign for each participant if not already assigned
+    needs_placeholder: list[int] = []
     for uid in participants:
         if uid in image_map and os.path.isfile(image_map[uid]):
             continue
-        # prefer to reuse an asset if available
-        chosen = None
-        if assets:
-            chosen = random.choice(assets)
-        # else generate a placeholder image for this user
-        if not chosen:
-            # generate a simple placeholder image and save
-            try:
-                from PIL import Image, ImageDraw, ImageFont
-            except Exception:
-                chosen = None
-            else:
-                img = Image.new("RGBA", (400, 400), tuple([random.randint(100, 255) for _ in range(3)]))
-                draw = ImageDraw.Draw(img)
-                # draw simple eyes
-                draw.ellipse((100-30, 120-30, 100+30, 120+30), fill=(255,255,255))
-                draw.ellipse((300-30, 120-30, 300+30, 120+30), fill=(255,255,255))
-                draw.ellipse((115-15, 135-15, 115+15, 135+15), fill=(0,0,0))
-                draw.ellipse((315-15, 135-15, 315+15, 135+15), fill=(0,0,0))
-                try:
-                    font = ImageFont.truetype("DejaVuSans-Bold.ttf", 28)
-                except Exception:
-                    font = ImageFont.load_default()
-                label = f"F-{str(uid)[-4:]}"
-                # Compute text size robustly: prefer draw.textbbox, fall back to font.getsize
-                try:
-                    bbox = draw.textbbox((0, 0), label, font=font)
-                    w = bbox[2] - bbox[0]
-                    h = bbox[3] - bbox[1]
-                except Exception:
-                    try:
-                        w, h = font.getsize(label)
-                    except Exception:
-                        w, h = (0, 0)
-                draw.text(((400-w)/2, 320), label, fill=(0,0,0), font=font)
-                out_path = os.path.join(FURBY_ASSETS_DIR, f"furby_user_{uid}.png")
-                try:
-                    os.makedirs(FURBY_ASSETS_DIR, exist_ok=True)
-                    img.save(out_path)
-                    chosen = out_path
-                except Exception:
-                    chosen = None
+        # prefer to reuse an asset if available (unique per player until the deck runs out)
+        chosen = _next_asset(lobby, assets)
         image_map[uid] = chosen
-    meta["image_map"] = image_map
-    tournaments_meta[msg_id] = meta
+        if not chosen and _PIL_OK:
+            needs_placeholder.append(uid)
+    # else generate placeholder images, all at once on the default executor's threads
+    if needs_placeholder:
+        loop = asyncio.get_running_loop()
+        rendered = await asyncio.gather(*(loop.run_in_executor(None, _render_placeholder, uid) for uid in needs_placeholder))
+        for uid, chosen in zip(needs_placeholder, rendered):
+            if chosen:
+                _remember_furby_image(chosen)
+            image_map[uid] = chosen
     return image_map
 
 # --------- Ghost currency helpers & shop ---------
 GHOST_EMOJI = "👻"
 
+# SQL kept as constants so every call site passes the identical string and hits the
+# connection's prepared-statement cache
+_SQL_ADD_GHOSTS = "INSERT INTO ghosts_balances(user_id, ghosts) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET ghosts = ghosts + excluded.ghosts"
+_SQL_GET_GHOSTS = "SELECT ghosts FROM ghosts_balances WHERE user_id = ?"
+_SQL_SET_GHOSTS = "INSERT INTO ghosts_balances(user_id, ghosts) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET ghosts = excluded.ghosts"
+_SQL_LIST_SHOP_GUILD = "SELECT id, name, price, role_id FROM shop_items WHERE guild_id = ?"
+_SQL_LIST_SHOP_GLOBAL = "SELECT id, name, price, role_id FROM shop_items WHERE guild_id IS NULL"
+_SQL_ADD_SHOP_ITEM = "INSERT INTO shop_items(guild_id, name, price, role_id, metadata) VALUES (?, ?, ?, ?, ?)"
+_SQL_REMOVE_SHOP_ITEM = "DELETE FROM shop_items WHERE id = ?"
+_SQL_GET_SHOP_ITEM = "SELECT id, guild_id, name, price, role_id, metadata FROM shop_items WHERE id = ?"
+
 def add_ghosts(user_id: int, amount: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT INTO ghosts_balances(user_id, ghosts) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET ghosts = ghosts + ?", (user_id, amount, amount))
-    conn.commit()
-    conn.close()
+    with db_cursor() as cur:
+        cur.execute(_SQL_ADD_GHOSTS, (user_id, amount))
+
+def add_ghosts_bulk(pairs: list[tuple[int, int]]):
+    """Add ghosts to several users in one transaction. pairs is a list of (user_id, amount).
+    Payouts to many users should collect pairs and call this once (one commit instead of N).
+    """
+    if not pairs:
+        return
+    with db_cursor(transaction=True) as cur:
+        cur.executemany(_SQL_ADD_GHOSTS, pairs)
 
 def get_ghosts(user_id: int) -> int:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT ghosts FROM ghosts_balances WHERE user_id = ?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
+    with db_cursor() as cur:
+        cur.execute(_SQL_GET_GHOSTS, (user_id,))
+        row = cur.fetchone()
     return row[0] if row else 0
 
+def record_tournament_win(winner_id: int, guild_id: int | None) -> tuple[int, int]:
+    """Count a win globally (and for the guild) in one transaction. Returns (global_wins, guild_wins)."""
+    # RETURNING hands back the updated count, so no follow-up SELECT is needed (SQLite 3.35+)
+    with db_cursor(transaction=True) as cur:
+        # global
+        cur.execute("INSERT INTO wins_global(user_id, wins) VALUES (?, 1) ON CONFLICT(user_id) DO UPDATE SET wins = wins + 1 RETURNING wins", (winner_id,))
+        global_wins = cur.fetchone()[0]
+        # guild
+        guild_wins = 0
+        if guild_id:
+            cur.execute("INSERT INTO wins_guild(guild_id, user_id, wins) VALUES (?, ?, 1) ON CONFLICT(guild_id, user_id) DO UPDATE SET wins = wins + 1 RETURNING wins", (guild_id, winner_id))
+            guild_wins = cur.fetchone()[0]
+    return global_wins, guild_wins
+
+
+def record_global_win(winner_id: int):
+    """Count a win in the global table only (used by the wheel)."""
+    with db_cursor() as cur:
+        cur.execute("INSERT INTO wins_global(user_id, wins) VALUES (?, 1) ON CONFLICT(user_id) DO UPDATE SET wins = wins + 1", (winner_id,))
+
+
 def set_ghosts(user_id: int, amount: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT INTO ghosts_balances(user_id, ghosts) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET ghosts = ?", (user_id, amount, amount))
-    conn.commit()
-    conn.close()
+    with db_cursor() as cur:
+        cur.execute(_SQL_SET_GHOSTS, (user_id, amount))
+
+
+# Staff status changes rarely, so cache it briefly instead of hitting SQLite (and possibly
+# Discord's REST API via fetch_member) on every win and staff-only command.
+STAFF_CACHE_TTL = 300  # seconds
+# (guild_id, user_id) -> (checked_at, is_staff)
+_staff_cache: dict[tuple[int, int], tuple[float, bool]] = {}
+# guild_id -> (checked_at, staff_role_id)
+_staff_role_cache: dict[int, tuple[float, int | None]] = {}
+# guild_id -> invalidation count; a lookup that straddles an invalidation doesn't store its answer
+_staff_generation: dict[int, int] = {}
+
+
+def invalidate_staff_cache(guild_id: int):
+    """Drop cached staff data for a guild (call on the event loop after its staff configuration changes)."""
+    _staff_generation[guild_id] = _staff_generation.get(guild_id, 0) + 1
+    _staff_role_cache.pop(guild_id, None)
+    for key in [k for k in list(_staff_cache) if k[0] == guild_id]:
+        _staff_cache.pop(key, None)
+
+
+async def get_staff_role_cached(guild_id: int) -> int | None:
+    """Like get_staff_role, but served from a short-lived cache when possible."""
+    now = time.monotonic()
+    hit = _staff_role_cache.get(guild_id)
+    if hit and now - hit[0] < STAFF_CACHE_TTL:
+        return hit[1]
+    gen = _staff_generation.get(guild_id, 0)
+    role_id = await run_db(get_staff_role, guild_id)
+    if _staff_generation.get(guild_id, 0) == gen:
+        _staff_role_cache[guild_id] = (now, role_id)
+    return role_id
 
 
 async def is_staff_in_guild(guild: discord.Guild | None, user_id: int) -> bool:
     """Async: Return True if the given user_id represents a staff member in the guild.
     Staff is defined as having a configured staff role (preferred) or Manage Guild/Administrator permissions.
+    Results are cached for STAFF_CACHE_TTL seconds per (guild, user).
     """
     if not guild:
         return False
-    gid = guild.id
-    # check configured staff role first
+    key = (guild.id, user_id)
+    now = time.monotonic()
+    hit = _staff_cache.get(key)
+    if hit and now - hit[0] < STAFF_CACHE_TTL:
+        return hit[1]
+    gen = _staff_generation.get(guild.id, 0)
+    result = await _check_staff_in_guild(guild, user_id)
+    if _staff_generation.get(guild.id, 0) == gen:
+        _staff_cache[key] = (now, result)
+    return result
+
+
+# (guild_id, user_id) -> expires_at for users Discord reported as not in the guild, so
+# repeated lookups don't keep hitting fetch_member
+MISSING_MEMBER_TTL = 300  # seconds
+_missing_members: dict[tuple[int, int], float] = {}
+
+
+async def get_guild_member(guild: discord.Guild, user_id: int) -> discord.Member | None:
+    """Return the member from the cache, falling back to a single REST fetch.
+    Users that are not in the guild are remembered for MISSING_MEMBER_TTL seconds.
+    """
+    member = guild.get_member(user_id)
+    if member is not None:
+        return member
+    key = (guild.id, user_id)
+    expires = _missing_members.get(key)
+    if expires is not None:
+        if time.monotonic() < expires:
+            return None
+        _missing_members.pop(key, None)
     try:
-        staff_role_id = get_staff_role(gid)
-        if staff_role_id:
-            # if the member has the role, they're staff
-            member = guild.get_member(user_id)
-            if member is None:
-                try:
-                    member = await guild.fetch_member(user_id)
-                except Exception:
-                    member = None
-            if member and any(r.id == staff_role_id for r in member.roles):
-                return True
+        return await guild.fetch_member(user_id)
+    except discord.NotFound:
+        _missing_members[key] = time.monotonic() + MISSING_MEMBER_TTL
     except Exception:
         pass
-    # fallback to permission check
-    try:
-        member = guild.get_member(user_id)
-        if not member:
+    return None
+
+
+@bot.listen("on_member_join")
+async def _forget_missing_member(member: discord.Member):
+    _missing_members.pop((member.guild.id, member.id), None)
+
+
+@bot.listen("on_member_update")
+async def _forget_staff_status(before: discord.Member, after: discord.Member):
+    # a role or permission change can flip staff status; don't serve a stale cached answer
+    if before.roles != after.roles:
+        _staff_cache.pop((after.guild.id, after.id), None)
+
+
+# user_id -> (display_name, fetched_at) for users that had to be fetched over REST
+USER_NAME_TTL = 600  # seconds
+_user_name_cache: dict[int, tuple[str, float]] = {}
+
+
+async def resolve_display_names(user_ids, guild: discord.Guild | None = None) -> dict[int, str]:
+    """Map user ids to display names. Uses the member/user caches first, then asks the
+    gateway for the guild's missing members in batches of 100, and only fetches users that
+    aren't in the guild over REST (concurrently). Fetched names are remembered for USER_NAME_TTL seconds.
+    """
+    now = time.monotonic()
+    names: dict[int, str] = {}
+    missing: list[int] = []
+    for uid in dict.fromkeys(user_ids):
+        user = (guild.get_member(uid) if guild else None) or bot.get_user(uid)
+        if user is not None:
+            names[uid] = user.display_name
+            continue
+        hit = _user_name_cache.get(uid)
+        if hit and now - hit[1] < USER_NAME_TTL:
+            names[uid] = hit[0]
+            continue
+        missing.append(uid)
+    if missing and guild is not None:
+        for i in range(0, len(missing), 100):
             try:
-                member = await guild.fetch_member(user_id)
+                members = await guild.query_members(user_ids=missing[i:i+100], limit=100, cache=True)
             except Exception:
-                return False
-    except Exception:
+                continue
+            for member in members:
+                names[member.id] = member.display_name
+        missing = [uid for uid in missing if uid not in names]
+    if missing:
+        fetched = await asyncio.gather(*(bot.fetch_user(uid) for uid in missing), return_exceptions=True)
+        for uid, user in zip(missing, fetched):
+            if isinstance(user, BaseException):
+                names[uid] = str(uid)
+                continue
+            names[uid] = user.display_name
+            _user_name_cache[uid] = (user.display_name, now)
+    return names
+
+
+async def _check_staff_in_guild(guild: discord.Guild, user_id: int) -> bool:
+    gid = guild.id
+    member = await get_guild_member(guild, user_id)
+    if member is None:
         return False
+    # check configured staff role first
+    try:
+        staff_role_id = await get_staff_role_cached(gid)
+        # if the member has the role, they're staff
+        if staff_role_id and any(r.id == staff_role_id for r in member.roles):
+            return True
+    except Exception:
+        pass
+    # fallback to permission check
     try:
         perms = member.guild_permissions
         return bool(perms.manage_guild or perms.administrator)
@@ -680,22 +1181,17 @@ async def is_staff_in_guild(guild: discord.Guild | None, user_id: int) -> bool:
 
 
 def set_staff_role(guild_id: int, role_id: int | None):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    if role_id is None:
-        cur.execute("INSERT INTO settings(guild_id, staff_role_id) VALUES (?, ?) ON CONFLICT(guild_id) DO UPDATE SET staff_role_id = NULL", (guild_id, None))
-    else:
-        cur.execute("INSERT INTO settings(guild_id, staff_role_id) VALUES (?, ?) ON CONFLICT(guild_id) DO UPDATE SET staff_role_id = ?", (guild_id, role_id, role_id))
-    conn.commit()
-    conn.close()
+    with db_cursor() as cur:
+        if role_id is None:
+            cur.execute("INSERT INTO settings(guild_id, staff_role_id) VALUES (?, ?) ON CONFLICT(guild_id) DO UPDATE SET staff_role_id = NULL", (guild_id, None))
+        else:
+            cur.execute("INSERT INTO settings(guild_id, staff_role_id) VALUES (?, ?) ON CONFLICT(guild_id) DO UPDATE SET staff_role_id = ?", (guild_id, role_id, role_id))
 
 
 def get_staff_role(guild_id: int) -> int | None:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT staff_role_id FROM settings WHERE guild_id = ?", (guild_id,))
-    row = cur.fetchone()
-    conn.close()
+    with db_cursor() as cur:
+        cur.execute("SELECT staff_role_id FROM settings WHERE guild_id = ?", (guild_id,))
+        row = cur.fetchone()
     return row[0] if row and row[0] is not None else None
 
 
@@ -710,24 +1206,18 @@ def set_mod_role(guild_id: int, command: str, role_id: int | None):
         field = 'mod_mute_role_id'
     else:
         return
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    if role_id is None:
-        cur.execute(f"INSERT INTO settings(guild_id, {field}) VALUES (?, ?) ON CONFLICT(guild_id) DO UPDATE SET {field} = NULL", (guild_id, None))
-    else:
-        cur.execute(f"INSERT INTO settings(guild_id, {field}) VALUES (?, ?) ON CONFLICT(guild_id) DO UPDATE SET {field} = ?", (guild_id, role_id, role_id))
-    conn.commit()
-    conn.close()
+    with db_cursor() as cur:
+        if role_id is None:
+            cur.execute(f"INSERT INTO settings(guild_id, {field}) VALUES (?, ?) ON CONFLICT(guild_id) DO UPDATE SET {field} = NULL", (guild_id, None))
+        else:
+            cur.execute(f"INSERT INTO settings(guild_id, {field}) VALUES (?, ?) ON CONFLICT(guild_id) DO UPDATE SET {field} = ?", (guild_id, role_id, role_id))
 
 
 def log_moderation(guild_id: int | None, action: str, target_id: int, moderator_id: int, reason: str | None = None):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("INSERT INTO mod_log(guild_id, action, target_id, moderator_id, reason, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-                    (guild_id, action, target_id, moderator_id, reason, datetime.utcnow().isoformat()))
-        conn.commit()
-        conn.close()
+        with db_cursor() as cur:
+            cur.execute("INSERT INTO mod_log(guild_id, action, target_id, moderator_id, reason, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        (guild_id, action, target_id, moderator_id, reason, datetime.utcnow().isoformat()))
     except Exception:
         pass
 
@@ -742,11 +1232,9 @@ def get_mod_role(guild_id: int, command: str) -> int | None:
         field = 'mod_mute_role_id'
     else:
         return None
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(f"SELECT {field} FROM settings WHERE guild_id = ?", (guild_id,))
-    row = cur.fetchone()
-    conn.close()
+    with db_cursor() as cur:
+        cur.execute(f"SELECT {field} FROM settings WHERE guild_id = ?", (guild_id,))
+        row = cur.fetchone()
     return row[0] if row and row[0] is not None else None
 
 
@@ -771,7 +1259,7 @@ async def has_mod_permission(interaction: discord.Interaction, command: str) ->
         if perms.administrator or perms.manage_guild:
             return True
         # check role
-        role_id = get_mod_role(interaction.guild.id, command)
+        role_id = await run_db(get_mod_role, interaction.guild.id, command)
         if role_id:
             if any(r.id == role_id for r in member.roles):
                 return True
@@ -855,7 +1343,7 @@ async def slash_ban(interaction: discord.Interaction, user_id: str, reason: str
     try:
         # attempt to ban by object id (works even if user not in guild)
         await interaction.guild.ban(discord.Object(id=uid), reason=reason)
-        log_moderation(interaction.guild.id, 'ban', uid, interaction.user.id, reason)
+        await run_db(log_moderation, interaction.guild.id, 'ban', uid, interaction.user.id, reason)
         await safe_reply(interaction, f'Banned <@{uid}>.')
     except Exception as e:
         await safe_reply(interaction, f'Failed to ban: {e}')
@@ -883,7 +1371,7 @@ async def slash_kick(interaction: discord.Interaction, user_id: str, reason: str
             await safe_reply(interaction, 'Member not found in guild.')
             return
         await member.kick(reason=reason)
-        log_moderation(interaction.guild.id, 'kick', member.id, interaction.user.id, reason)
+        await run_db(log_moderation, interaction.guild.id, 'kick', member.id, interaction.user.id, reason)
         await safe_reply(interaction, f'Kicked {member.mention}.')
     except Exception as e:
         await safe_reply(interaction, f'Failed to kick: {e}')
@@ -963,7 +1451,7 @@ async def slash_mute(interaction: discord.Interaction, user_id: str, duration: s
         if unmute_ts:
             users = muted_until.setdefault(interaction.guild.id, {})
             users[member.id] = unmute_ts
-        log_moderation(interaction.guild.id, 'mute', member.id, interaction.user.id, reason)
+        await run_db(log_moderation, interaction.guild.id, 'mute', member.id, interaction.user.id, reason)
         await safe_reply(interaction, f'{member.mention} has been muted.')
     except Exception as e:
         await safe_reply(interaction, f'Failed to mute: {e}')
@@ -990,7 +1478,7 @@ async def slash_settings_mod(interaction: discord.Interaction, command: str, rol
         return
     role_id = role.id if role else None
     try:
-        set_mod_role(interaction.guild.id, command, role_id)
+        await run_db(set_mod_role, interaction.guild.id, command, role_id)
         if role_id:
             await safe_reply(interaction, f'Role {role.name} set for {command}.')
         else:
@@ -1025,46 +1513,189 @@ async def safe_reply(interaction: discord.Interaction, content: str, ephemeral:
         pass
 
 def list_shop_items(guild_id: int | None = None):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    if guild_id:
-        cur.execute("SELECT id, name, price, role_id FROM shop_items WHERE guild_id = ?", (guild_id,))
-    else:
-        cur.execute("SELECT id, name, price, role_id FROM shop_items WHERE guild_id IS NULL")
-    rows = cur.fetchall()
-    conn.close()
+    with db_cursor() as cur:
+        if guild_id:
+            cur.execute(_SQL_LIST_SHOP_GUILD, (guild_id,))
+        else:
+            cur.execute(_SQL_LIST_SHOP_GLOBAL)
+        rows = cur.fetchall()
     return rows
 
 def add_shop_item(name: str, price: int, guild_id: int | None = None, role_id: int | None = None, metadata: str | None = None):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT INTO shop_items(guild_id, name, price, role_id, metadata) VALUES (?, ?, ?, ?, ?)", (guild_id, name, price, role_id, metadata))
-    conn.commit()
-    conn.close()
+    with db_cursor() as cur:
+        cur.execute(_SQL_ADD_SHOP_ITEM, (guild_id, name, price, role_id, metadata))
 
 def remove_shop_item(item_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM shop_items WHERE id = ?", (item_id,))
-    conn.commit()
-    conn.close()
+    with db_cursor() as cur:
+        cur.execute(_SQL_REMOVE_SHOP_ITEM, (item_id,))
 
 def get_shop_item(item_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT id, guild_id, name, price, role_id, metadata FROM shop_items WHERE id = ?", (item_id,))
-    row = cur.fetchone()
-    conn.close()
+    with db_cursor() as cur:
+        cur.execute(_SQL_GET_SHOP_ITEM, (item_id,))
+        row = cur.fetchone()
     return row
 
-def maybe_halloween_announce(channel: discord.abc.GuildChannel):
+# (day, active) so the month/day check runs once per day
+_halloween_day_cache: tuple[date, bool] | None = None
+
+
+def halloween_active() -> bool:
+    global _halloween_day_cache
     today = date.today()
-    if today.month == 10 and 25 <= today.day <= 31:
-        if random.random() < 0.25:
-            try:
-                asyncio.create_task(run_coro_safe(channel.send(f"Halloween event active! In this game the winner will receive {GHOST_EMOJI} ghosts."), name=f"halloween-announce-{getattr(channel, 'id', 'chan')}"))
-            except Exception:
-                pass
+    if _halloween_day_cache is None or _halloween_day_cache[0] != today:
+        _halloween_day_cache = (today, today.month == 10 and 25 <= today.day <= 31)
+    return _halloween_day_cache[1]
+
+
+# don't re-roll the announcement in a channel more often than this
+HALLOWEEN_ANNOUNCE_COOLDOWN = 60  # seconds
+# channel_id -> monotonic time of the last announcement
+_last_halloween: dict[int | None, float] = {}
+# the bot's event loop, captured in on_ready so announcements can be scheduled from any thread
+_main_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _send_halloween_announce(channel: discord.abc.GuildChannel):
+    asyncio.ensure_future(run_coro_safe(channel.send(f"Halloween event active! In this game the winner will receive {GHOST_EMOJI} ghosts."), name=f"halloween-announce-{getattr(channel, 'id', 'chan')}"))
+
+
+def maybe_halloween_announce(channel: discord.abc.GuildChannel):
+    if not halloween_active():
+        return
+    cid = getattr(channel, 'id', None)
+    now = time.monotonic()
+    last = _last_halloween.get(cid)
+    if last is not None and now - last < HALLOWEEN_ANNOUNCE_COOLDOWN:
+        return
+    if random.random() >= 0.25:
+        return
+    loop = _main_loop
+    if loop is None or not loop.is_running():
+        return
+    _last_halloween[cid] = now
+    try:
+        loop.call_soon_threadsafe(_send_halloween_announce, channel)
+    except Exception:
+        pass
+
+# Predefined goofy battle narration (English)
+BATTLE_ATTACKS = (
+    "{a} charges in and absolutely annihilates {d} with a glittery headbutt!",
+    "{a} uses a supersonic squeak — {d} doesn't even see it coming.",
+    "{a} performs the legendary Furby-Flick: {d} is flung into the void.",
+    "{a} whispers 'tickle' and {d} mysteriously collapses laughing.",
+)
+BATTLE_KILLS = (
+    "{k} lands the final blow — {v} is out!",
+    "With dramatic flair, {k} defeats {v}.",
+    "{v} was fluffed to bits by {k}.",
+)
+BATTLE_REVIVES = (
+    "But wait! {d} coughs up a spare battery and springs back to life!",
+    "A mysterious fairy grants {d} a second chance — back in the fight!",
+    "{d} finds a hidden extra life under its fluff and returns, enraged!",
+)
+BATTLE_TAUNTS = (
+    "{a} taunts {d} with an evil giggle.",
+    "{a} does a victory dance over {d}.",
+)
+
+
+def _battle_round_delay(alive_count: int) -> float:
+    """Seconds to wait between rounds: quick while the field is crowded, the full pause
+    (6-8s) once it's down to the final three.
+    """
+    base = max(1.5, 6.0 - 0.3 * max(0, alive_count - 3))
+    return random.uniform(base, base + 2)
+
+
+@dataclass
+class BattleRound:
+    """One narrated round of a tournament battle."""
+    text: str
+    killer: int
+    alive_count: int  # furbies still standing after this round
+
+
+async def _simulate_battle(alive: list[int], mentions: dict[int, str], events: asyncio.Queue) -> int:
+    """Roll pairwise eliminations until one furby remains, queueing each round for the
+    sender (None marks the end). Returns the winner's id.
+    """
+    alive = list(alive)
+    # uid -> index in alive, so eliminations are O(1) swap-removes instead of list.remove
+    alive_pos = {uid: i for i, uid in enumerate(alive)}
+    revived_once = set()
+    max_revives = max(1, len(alive) // 10)  # limited number of revives (at least 1)
+    revives_used = 0
+    cancelled = False
+    try:
+        while len(alive) > 1:
+            # pick two distinct combatants
+            a, d = random.sample(alive, 2)
+            lines = [random.choice(BATTLE_ATTACKS).format(a=mentions[a], d=mentions[d])]
+
+            # For flavor, randomly decide who wins this encounter (attacker or defender)
+            killer, victim = (a, d) if random.random() < 0.6 else (d, a)
+            idx = alive_pos.pop(victim)
+            last = alive.pop()
+            if last != victim:
+                alive[idx] = last
+                alive_pos[last] = idx
+            lines.append(random.choice(BATTLE_KILLS).format(k=mentions[killer], v=mentions[victim]))
+
+            # chance to revive (60%) if revives left and the furby hasn't revived before
+            if revives_used < max_revives and victim not in revived_once and random.random() < 0.6:
+                revived_once.add(victim)
+                revives_used += 1
+                alive_pos[victim] = len(alive)
+                alive.append(victim)
+                lines.append(random.choice(BATTLE_REVIVES).format(d=mentions[victim]))
+            elif random.random() < 0.3:
+                # sometimes add a taunt or short comment
+                lines.append(random.choice(BATTLE_TAUNTS).format(a=mentions[killer], d=mentions[victim]))
+
+            await events.put(BattleRound("\n".join(lines), killer, len(alive)))
+    except asyncio.CancelledError:
+        # cancelled together with the sender, so nobody is left to read a sentinel
+        cancelled = True
+        raise
+    finally:
+        if not cancelled:
+            await events.put(None)
+    return alive[0]
+
+
+async def _send_battle_rounds(channel, events: asyncio.Queue, image_map: dict, image_bytes: dict, image_names: dict):
+    """Post queued battle rounds one message each, showing the killer's image if available,
+    pausing between rounds until the None sentinel arrives.
+    """
+    # one embed for the whole battle; send() serializes it, so it's safe to mutate per round
+    embed_round = discord.Embed()
+    while True:
+        event = await events.get()
+        if event is None:
+            return
+        killer_img = image_map.get(event.killer)
+        killer_bytes = image_bytes.get(killer_img)
+        try:
+            if killer_bytes:
+                embed_round.description = event.text
+                try:
+                    file = discord.File(io.BytesIO(killer_bytes), filename=image_names[killer_img])
+                    embed_round.set_image(url=f"attachment://{file.filename}")
+                    await send_with_retry(channel, embed=embed_round, file=file)
+                except Exception:
+                    await send_with_retry(channel, event.text)
+            else:
+                await send_with_retry(channel, event.text)
+        except discord.Forbidden:
+            logging.warning("cannot send battle message in channel %s - missing permissions.", getattr(channel, 'id', None))
+        except discord.HTTPException as e:
+            logging.warning("failed to send battle message: %s", e)
+
+        # short cooldown before next encounter
+        await asyncio.sleep(_battle_round_delay(event.alive_count))
+
 
 class TournamentView(discord.ui.View):
     def __init__(self, host: discord.Member | None = None, timeout: int | None = None):
@@ -1087,33 +1718,31 @@ class TournamentView(discord.ui.View):
             except Exception:
                 pass
 
-        msg_id = interaction.message.id
-        participants = tournaments.setdefault(msg_id, set())
-        meta = tournaments_meta.get(msg_id, {})
-        maxp = meta.get("max_participants", 50)
+        lobby = get_lobby(interaction.message.id)
+        participants = lobby.participants
+        maxp = lobby.max_participants
 
-        if interaction.user.id in participants:
-            # already joined
+        status = lobby.try_add(interaction.user.id)
+        if status == "already":
             try:
                 await safe_reply(interaction, "You are already in the tournament.")
             except Exception:
                 pass
             return
-        if len(participants) >= maxp:
+        if status == "full":
             try:
                 await safe_reply(interaction, f"Tournament is full ({maxp} participants). You can't join.")
             except Exception:
                 pass
             return
 
-        participants.add(interaction.user.id)
         # build a small participant preview
-        preview = "\n".join([f"<@{uid}>" for uid in list(participants)[:20]])
+        preview = "\n".join(f"<@{uid}>" for uid in itertools.islice(participants, 20))
         try:
             await safe_reply(interaction, f"{interaction.user.mention} just joined the tournament.\nParticipants: {len(participants)}/{maxp}\n\n{preview}")
         except Exception:
             pass
-        await update_tournament_message(interaction.message)
+        schedule_tournament_update(interaction.message)
 
     @discord.ui.button(label="Leave Tournament", style=discord.ButtonStyle.danger, emoji="🚪")
     async def leave_button(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -1125,23 +1754,22 @@ class TournamentView(discord.ui.View):
             except Exception:
                 pass
 
-        msg_id = interaction.message.id
-        participants = tournaments.setdefault(msg_id, set())
+        lobby = get_lobby(interaction.message.id)
+        participants = lobby.participants
         if interaction.user.id not in participants:
             try:
                 await safe_reply(interaction, "You are not in the tournament.")
             except Exception:
                 pass
             return
-        participants.remove(interaction.user.id)
-        meta = tournaments_meta.get(msg_id, {})
-        maxp = meta.get("max_participants", 50)
-        preview = "\n".join([f"<@{uid}>" for uid in list(participants)[:20]])
+        participants.pop(interaction.user.id, None)
+        maxp = lobby.max_participants
+        preview = "\n".join(f"<@{uid}>" for uid in itertools.islice(participants, 20))
         try:
             await safe_reply(interaction, f"{interaction.user.mention} left the tournament.\nParticipants: {len(participants)}/{maxp}\n\n{preview if preview else 'No participants.'}")
         except Exception:
             pass
-        await update_tournament_message(interaction.message)
+        schedule_tournament_update(interaction.message)
 
     @discord.ui.button(label="Start Tournament", style=discord.ButtonStyle.primary, emoji="▶️")
     async def start_button(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -1163,7 +1791,8 @@ class TournamentView(discord.ui.View):
             return
 
         msg_id = interaction.message.id
-        participants = tournaments.get(msg_id, set())
+        lobby = lobbies.get(msg_id)
+        participants = lobby.participants if lobby else {}
         if len(participants) < 2:
             try:
                 await safe_reply(interaction, "Need at least 2 participants to start.")
@@ -1172,8 +1801,6 @@ class TournamentView(discord.ui.View):
             return
 
         # Start a fun battle simulation with messages in the channel.
-        import random
-
         channel = interaction.channel
 
         # Acknowledge the interaction quickly
@@ -1183,154 +1810,36 @@ class TournamentView(discord.ui.View):
             # If we've already responded, ignore
             pass
 
-        # Prepare battle state
         alive = list(participants)
-        eliminated = []
-        revived_once = set()
-        meta = tournaments_meta.get(msg_id, {})
-        max_revives = max(1, len(alive) // 10)  # limited number of revives (at least 1)
-        revives_used = 0
-
-        # Predefined goofy messages (English)
-        attacks = [
-            "{a} charges in and absolutely annihilates {d} with a glittery headbutt!",
-            "{a} uses a supersonic squeak — {d} doesn't even see it coming.",
-            "{a} performs the legendary Furby-Flick: {d} is flung into the void.",
-            "{a} whispers 'tickle' and {d} mysteriously collapses laughing.",
-        ]
-        revives_msgs = [
-            "But wait! {d} coughs up a spare battery and springs back to life!",
-            "A mysterious fairy grants {d} a second chance — back in the fight!",
-            "{d} finds a hidden extra life under its fluff and returns, enraged!",
-        ]
-        taunts = [
-            "{a} taunts {d} with an evil giggle.",
-            "{a} does a victory dance over {d}.",
-        ]
-        # Ensure each participant has an image assigned (consistent across the tournament)
-        image_map = ensure_participant_images(msg_id, alive)
-
-        # Battle loop: pairwise eliminations until one remains
-        while len(alive) > 1:
-            # pick two distinct combatants
-            a, d = random.sample(alive, 2)
-            # choose an attack message and maybe an image for attacker or defender
-            msg_text = random.choice(attacks).format(a=f"<@{a}>", d=f"<@{d}>")
-            # select images for attacker and defender if available
-            attacker_img = image_map.get(a)
-            defender_img = image_map.get(d)
-            try:
-                if attacker_img:
-                    embed_msg = discord.Embed(description=msg_text)
-                    try:
-                        file = discord.File(attacker_img)
-                        embed_msg.set_image(url=f"attachment://{os.path.basename(attacker_img)}")
-                        await channel.send(embed=embed_msg, file=file)
-                    except Exception:
-                        await channel.send(msg_text)
-                else:
-                    await channel.send(msg_text)
-            except discord.Forbidden:
-                print(f"Warning: cannot send battle message in channel {getattr(channel, 'id', None)} - missing permissions.")
-            except discord.HTTPException as e:
-                print(f"Warning: failed to send battle message: {e}")
-
-            # random cooldown between messages (5 to 10 seconds)
-            await asyncio.sleep(random.uniform(5, 10))
-
-            # determine outcome: d has a chance to be revived after death
-            # For flavor, randomly decide who wins this encounter (attacker or defender)
-            killer, victim = (a, d) if random.random() < 0.6 else (d, a)
-            # victim is 'killed'
-            if victim in alive:
-                alive.remove(victim)
-                eliminated.append(victim)
-            # announce kill
-            kill_texts = [
-                f"{f'<@{killer}>'} lands the final blow — {f'<@{victim}>'} is out!",
-                f"With dramatic flair, {f'<@{killer}>'} defeats {f'<@{victim}>'}.",
-                f"{f'<@{victim}>'} was fluffed to bits by {f'<@{killer}>'}.",
-            ]
-            try:
-                # use killer's image if available
-                killer_img = image_map.get(killer)
-                text = random.choice(kill_texts)
-                if killer_img:
-                    embed_kill = discord.Embed(description=text)
-                    try:
-                        file = discord.File(killer_img)
-                        embed_kill.set_image(url=f"attachment://{os.path.basename(killer_img)}")
-                        await channel.send(embed=embed_kill, file=file)
-                    except Exception:
-                        await channel.send(text)
-                else:
-                    await channel.send(text)
-            except discord.Forbidden:
-                print(f"Warning: cannot send kill message in channel {getattr(channel, 'id', None)} - missing permissions.")
-            except discord.HTTPException as e:
-                print(f"Warning: failed to send kill message: {e}")
-
-            # chance to revive (60%) if revives left and the furby hasn't revived before
-            if revives_used < max_revives and victim not in revived_once and random.random() < 0.6:
-                revived_once.add(victim)
-                revives_used += 1
-                alive.append(victim)
-                try:
-                    rev_msg = random.choice(revives_msgs).format(d=f"<@{victim}>")
-                    victim_img = image_map.get(victim)
-                    if victim_img:
-                        embed_rev = discord.Embed(description=rev_msg)
-                        try:
-                            file = discord.File(victim_img)
-                            embed_rev.set_image(url=f"attachment://{os.path.basename(victim_img)}")
-                            await channel.send(embed=embed_rev, file=file)
-                        except Exception:
-                            await channel.send(rev_msg)
-                    else:
-                        await channel.send(rev_msg)
-                except discord.Forbidden:
-                    print(f"Warning: cannot send revive message in channel {getattr(channel, 'id', None)} - missing permissions.")
-                except discord.HTTPException as e:
-                    print(f"Warning: failed to send revive message: {e}")
-            else:
-                # sometimes add a taunt or short comment
-                if random.random() < 0.3:
-                    try:
-                        await channel.send(random.choice(taunts).format(a=f"<@{killer}>", d=f"<@{victim}>"))
-                    except discord.Forbidden:
-                        pass
-                    except discord.HTTPException:
-                        pass
 
-            # short cooldown before next encounter
-            await asyncio.sleep(random.uniform(5, 10))
+        # Ensure each participant has an image assigned (consistent across the tournament)
+        image_map = await ensure_participant_images(msg_id, alive)
+        # read every image once, off the loop, so the round sends below do no disk I/O
+        loop = asyncio.get_running_loop()
+        image_bytes = await loop.run_in_executor(None, _read_image_files, set(image_map.values()))
+        image_names = {path: os.path.basename(path) for path in image_bytes}
+        mentions = {uid: f"<@{uid}>" for uid in alive}
+
+        # Battle: one task rolls the rounds, another narrates them at the round cadence.
+        events: asyncio.Queue[BattleRound | None] = asyncio.Queue(maxsize=8)
+        producer = asyncio.create_task(_simulate_battle(alive, mentions, events))
+        consumer = asyncio.create_task(_send_battle_rounds(channel, events, image_map, image_bytes, image_names))
+        try:
+            winner_id, _ = await asyncio.gather(producer, consumer)
+        finally:
+            # gather doesn't cancel the sibling: if the narrator dies, the producer would block
+            # forever on the full queue (TaskGroup would do this, but it needs Python 3.11)
+            producer.cancel()
+            consumer.cancel()
 
         # Winner determined
-        winner_id = alive[0]
         guild = interaction.guild
 
         # Save stats to SQLite
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        # global
-        cur.execute("INSERT INTO wins_global(user_id, wins) VALUES (?, 1) ON CONFLICT(user_id) DO UPDATE SET wins = wins + 1", (winner_id,))
-        # guild
-        if guild:
-            cur.execute("INSERT INTO wins_guild(guild_id, user_id, wins) VALUES (?, ?, 1) ON CONFLICT(guild_id, user_id) DO UPDATE SET wins = wins + 1", (guild.id, winner_id))
-        conn.commit()
-        # fetch stats to show
-        cur.execute("SELECT wins FROM wins_global WHERE user_id = ?", (winner_id,))
-        global_wins = cur.fetchone()[0]
-        guild_wins = 0
-        if guild:
-            cur.execute("SELECT wins FROM wins_guild WHERE guild_id = ? AND user_id = ?", (guild.id, winner_id))
-            row = cur.fetchone()
-            guild_wins = row[0] if row else 0
-        conn.close()
+        global_wins, guild_wins = await run_db(record_tournament_win, winner_id, guild.id if guild else None)
 
         # compute duration
-        meta = tournaments_meta.get(msg_id, {})
-        start_ts = meta.get("start")
+        start_ts = lobby.start
         duration_text = "unknown"
         if start_ts:
             dur = int(time.time() - start_ts)
@@ -1344,14 +1853,16 @@ class TournamentView(discord.ui.View):
         try:
             await channel.send(f"Tournament finished! Winner: {winner_mention}. Host: {host_mention}")
         except discord.Forbidden:
-            print(f"Warning: cannot send final announcement in channel {getattr(channel, 'id', None)} - missing permissions.")
+            logging.warning("cannot send final announcement in channel %s - missing permissions.", getattr(channel, 'id', None))
         except discord.HTTPException as e:
-            print(f"Warning: failed to send final announcement: {e}")
+            logging.warning("failed to send final announcement: %s", e)
 
         # Award ghosts for the tournament: 2 ghosts per participant
         try:
             participants_total = len(participants)
             ghosts_awarded = 2 * participants_total
+            # (user_id, amount) pairs written in one transaction; add runner-up payouts here
+            payouts = [(winner_id, ghosts_awarded)]
             # staff have unlimited ghosts (do not modify DB)
             try:
                 if await is_staff_in_guild(interaction.guild, winner_id):
@@ -1360,7 +1871,7 @@ class TournamentView(discord.ui.View):
                     except Exception:
                         pass
                 else:
-                    add_ghosts(winner_id, ghosts_awarded)
+                    await run_db(add_ghosts_bulk, payouts)
                     try:
                         await channel.send(f"{GHOST_EMOJI} {ghosts_awarded} ghosts have been awarded to {winner_mention}!")
                     except Exception:
@@ -1368,23 +1879,18 @@ class TournamentView(discord.ui.View):
             except Exception:
                 # fallback: attempt to award normally
                 try:
-                    add_ghosts(winner_id, ghosts_awarded)
+                    await run_db(add_ghosts_bulk, payouts)
                 except Exception:
                     pass
         except Exception:
             pass
 
-        # Optionally disable buttons after start
+        # a debounced participant refresh must not land on top of the results
+        cancel_tournament_update(msg_id)
+        # Disable buttons and add the results in a single edit
         for child in self.children:
             child.disabled = True
-        try:
-            await interaction.message.edit(view=self)
-        except discord.Forbidden:
-            print(f"Warning: cannot edit view for message {interaction.message.id} - missing permissions.")
-        except discord.HTTPException as e:
-            print(f"Warning: failed to edit view for message {interaction.message.id}: {e}")
 
-        # Edit embed to include results
         try:
             embed = interaction.message.embeds[0]
         except IndexError:
@@ -1400,11 +1906,11 @@ class TournamentView(discord.ui.View):
         new_embed = embed.copy()
         new_embed.add_field(name="Results", value=results_field, inline=False)
         try:
-            await interaction.message.edit(embed=new_embed)
+            await interaction.message.edit(embed=new_embed, view=self)
         except discord.Forbidden:
-            print(f"Warning: cannot edit message {interaction.message.id} to add results - missing permissions.")
+            logging.warning("cannot edit message %s to add results - missing permissions.", interaction.message.id)
         except discord.HTTPException as e:
-            print(f"Warning: failed to edit message {interaction.message.id} to add results: {e}")
+            logging.warning("failed to edit message %s to add results: %s", interaction.message.id, e)
 
     @discord.ui.button(label="Cancel Tournament", style=discord.ButtonStyle.secondary, emoji="❌")
     async def cancel_button(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -1416,7 +1922,8 @@ class TournamentView(discord.ui.View):
                 pass
             return
         msg_id = interaction.message.id
-        tournaments.pop(msg_id, None)
+        lobbies.pop(msg_id, None)
+        cancel_tournament_update(msg_id)
         try:
             await safe_reply(interaction, "Tournament cancelled.")
         except Exception:
@@ -1427,9 +1934,9 @@ class TournamentView(discord.ui.View):
         try:
             await interaction.message.edit(view=self)
         except discord.Forbidden:
-            print(f"Warning: cannot edit view for message {interaction.message.id} - missing permissions.")
+            logging.warning("cannot edit view for message %s - missing permissions.", interaction.message.id)
         except discord.HTTPException as e:
-            print(f"Warning: failed to edit view for message {interaction.message.id}: {e}")
+            logging.warning("failed to edit view for message %s: %s", interaction.message.id, e)
 
 
 # ---------------- Slash commands: ghosts balance & shop ----------------
@@ -1437,7 +1944,7 @@ class TournamentView(discord.ui.View):
 @app_commands.describe(user="User to check (optional)")
 async def ghosts_balance(interaction: discord.Interaction, user: discord.User | None = None):
     target = user or interaction.user
-    bal = get_ghosts(target.id)
+    bal = await run_db(get_ghosts, target.id)
     await interaction.response.send_message(f"{GHOST_EMOJI} {bal} ghosts — {target.mention}", ephemeral=True)
 
 
@@ -1455,8 +1962,8 @@ async def give_ghosts(interaction: discord.Interaction, target: discord.User, am
             await safe_reply(interaction, "You are not authorized to give ghosts. Staff only.")
             return
         # proceed to give ghosts
-        add_ghosts(target.id, amount)
-        bal = get_ghosts(target.id)
+        await run_db(add_ghosts, target.id, amount)
+        bal = await run_db(get_ghosts, target.id)
         await safe_reply(interaction, f"{GHOST_EMOJI} {amount} ghosts given to {target.mention}. New balance: {bal}")
     except Exception as e:
         await safe_reply(interaction, f"Error giving ghosts: {e}")
@@ -1472,9 +1979,9 @@ except Exception:
 @shop_group.command(name="list", description="List available shop items for this server or global ones")
 async def shop_list(interaction: discord.Interaction):
     gid = interaction.guild.id if interaction.guild else None
-    items = list_shop_items(gid)
+    items = await run_db(list_shop_items, gid)
     if not items:
-        items = list_shop_items(None)
+        items = await run_db(list_shop_items, None)
     if not items:
         await interaction.response.send_message("No shop items available.", ephemeral=True)
         return
@@ -1489,7 +1996,7 @@ async def shop_list(interaction: discord.Interaction):
 @shop_group.command(name="buy", description="Buy a shop item using ghosts")
 @app_commands.describe(item_id="ID of the shop item to buy")
 async def shop_buy(interaction: discord.Interaction, item_id: int):
-    row = get_shop_item(item_id)
+    row = await run_db(get_shop_item, item_id)
     if not row:
         await interaction.response.send_message("Item not found.", ephemeral=True)
         return
@@ -1499,12 +2006,12 @@ async def shop_buy(interaction: discord.Interaction, item_id: int):
         await interaction.response.send_message("This item is not available on this server.", ephemeral=True)
         return
     user_id = interaction.user.id
-    bal = get_ghosts(user_id)
+    bal = await run_db(get_ghosts, user_id)
     if bal < price:
         await interaction.response.send_message(f"You don't have enough {GHOST_EMOJI}. You have {bal}, but the item costs {price}.", ephemeral=True)
         return
     # deduct
-    add_ghosts(user_id, -price)
+    await run_db(add_ghosts, user_id, -price)
     # assign role if applicable
     if role_id and interaction.guild:
         try:
@@ -1525,18 +2032,18 @@ async def shop_buy(interaction: discord.Interaction, item_id: int):
 async def shop_add(interaction: discord.Interaction, name: str, price: int, role: discord.Role | None = None, global_item: bool = False):
     gid = None if global_item else (interaction.guild.id if interaction.guild else None)
     role_id = role.id if role else None
-    add_shop_item(name=name, price=price, guild_id=gid, role_id=role_id)
+    await run_db(add_shop_item, name=name, price=price, guild_id=gid, role_id=role_id)
     await interaction.response.send_message(f"Added shop item: {name} — {price} {GHOST_EMOJI}", ephemeral=True)
 
 
 @shop_group.command(name="remove", description="(Admin) Remove a shop item by id")
 @app_commands.checks.has_permissions(manage_guild=True)
 async def shop_remove(interaction: discord.Interaction, item_id: int):
-    row = get_shop_item(item_id)
+    row = await run_db(get_shop_item, item_id)
     if not row:
         await interaction.response.send_message("Item not found.", ephemeral=True)
         return
-    remove_shop_item(item_id)
+    await run_db(remove_shop_item, item_id)
     await interaction.response.send_message(f"Removed shop item {item_id}.", ephemeral=True)
 
 
@@ -1559,7 +2066,9 @@ async def settings_set_staff_role(interaction: discord.Interaction, role: discor
         return
     try:
         role_id = role.id if role else None
-        set_staff_role(interaction.guild.id, role_id)
+        await run_db(set_staff_role, interaction.guild.id, role_id)
+        # the caches belong to the event loop, so invalidate here rather than on the DB thread
+        invalidate_staff_cache(interaction.guild.id)
         if role:
             await interaction.response.send_message(f"Staff role set to {role.mention}.", ephemeral=True)
         else:
@@ -1574,7 +2083,7 @@ async def settings_get_staff_role(interaction: discord.Interaction):
         await interaction.response.send_message("This command must be used in a server.", ephemeral=True)
         return
     try:
-        role_id = get_staff_role(interaction.guild.id)
+        role_id = await run_db(get_staff_role, interaction.guild.id)
         if role_id:
             role = interaction.guild.get_role(role_id)
             if role:
@@ -1588,33 +2097,71 @@ async def settings_get_staff_role(interaction: discord.Interaction):
         await interaction.response.send_message(f"Failed to read staff role: {e}", ephemeral=True)
     
 
+# join/leave bursts are coalesced into one embed edit per message
+TOURNAMENT_EDIT_DEBOUNCE = 1.0  # seconds
+# message_id -> pending delayed update
+_pending_updates: dict[int, asyncio.Task] = {}
+
+
+def cancel_tournament_update(msg_id: int):
+    """Drop a pending debounced embed edit (the lobby is ending and its message is about to change)."""
+    pending = _pending_updates.pop(msg_id, None)
+    if pending and not pending.done():
+        pending.cancel()
+
+
+def schedule_tournament_update(message: discord.Message):
+    """Refresh the tournament embed once clicks go quiet; each call pushes the edit back."""
+    pending = _pending_updates.get(message.id)
+    if pending and not pending.done():
+        pending.cancel()
+    _pending_updates[message.id] = asyncio.create_task(_delayed_tournament_update(message))
+
+
+async def _delayed_tournament_update(message: discord.Message):
+    await asyncio.sleep(TOURNAMENT_EDIT_DEBOUNCE)
+    try:
+        # the lobby was cancelled or finished meanwhile; don't overwrite its final embed
+        if lobbies.get(message.id) is None:
+            return
+        await update_tournament_message(message)
+    finally:
+        if _pending_updates.get(message.id) is asyncio.current_task():
+            _pending_updates.pop(message.id, None)
+
+
 async def update_tournament_message(message: discord.Message):
     """Update the embed of the tournament message to reflect current participants."""
     msg_id = message.id
-    participants = tournaments.get(msg_id, set())
+    lobby = lobbies.get(msg_id)
+    participants = lobby.participants if lobby else {}
     embed = message.embeds[0]
     # Rebuild the description with updated participant count and list
-    base_description = embed.description.split("\n\n", 1)[0]
+    base_description = lobby.base_description if lobby else None
+    if base_description is None:
+        # lobby from before a restart: recover what we can from the posted embed
+        base_description = (embed.description or "").split("\n\n", 1)[0]
     # create a small participants list
     if participants:
         # show up to 50 in the embed, but cap visual list to 50
         part_lines = []
-        for uid in list(participants)[:50]:
+        for uid in itertools.islice(participants, 50):
             part_lines.append(f"<@{uid}>")
         participants_text = "\n".join(part_lines)
     else:
         participants_text = "No participants yet."
 
     # include max participants info if available
-    meta = tournaments_meta.get(msg_id, {})
-    maxp = meta.get("max_participants")
+    maxp = lobby.max_participants if lobby else None
     if maxp:
         full_text = " (FULL)" if len(participants) >= maxp else ""
         new_description = f"{base_description}\n\nParticipants ({len(participants)}/{maxp}){full_text}:\n{participants_text}"
     else:
         new_description = f"{base_description}\n\nParticipants ({len(participants)}):\n{participants_text}"
-    new_embed = embed.copy()
-    new_embed.description = new_description
+    # fresh embed instead of a deep copy; the lobby embed only carries title, color and footer
+    new_embed = discord.Embed(title=embed.title, description=new_description, color=embed.color)
+    if embed.footer and embed.footer.text:
+        new_embed.set_footer(text=embed.footer.text)
     # Attempt to edit the message but handle missing permissions or HTTP errors gracefully
     try:
         # If message.author is available and not the bot, editing may fail with Forbidden
@@ -1622,10 +2169,10 @@ async def update_tournament_message(message: discord.Message):
         await message.edit(embed=new_embed)
     except discord.Forbidden:
         # Bot lacks permission to edit this message (maybe original author is not the bot or channel perms)
-        print(f"Warning: cannot edit message {msg_id} - missing permissions (403 Forbidden). Skipping embed update.")
+        logging.warning("cannot edit message %s - missing permissions (403 Forbidden). Skipping embed update.", msg_id)
     except discord.HTTPException as e:
         # Generic HTTP error from Discord
-        print(f"Warning: failed to edit message {msg_id} due to HTTP error: {e}")
+        logging.warning("failed to edit message %s due to HTTP error: %s", msg_id, e)
 
 
 @bot.event
@@ -1647,8 +2194,8 @@ async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
             return
         participants = wheels.setdefault(msg_id, set())
         participants.add(payload.user_id)
-    except Exception as e:
-        print("Error in on_raw_reaction_add:", e)
+    except Exception:
+        logging.exception("Error in on_raw_reaction_add")
 
 
 @bot.event
@@ -1663,8 +2210,8 @@ async def on_raw_reaction_remove(payload: discord.RawReactionActionEvent):
             return
         participants = wheels.setdefault(msg_id, set())
         participants.discard(payload.user_id)
-    except Exception as e:
-        print("Error in on_raw_reaction_remove:", e)
+    except Exception:
+        logging.exception("Error in on_raw_reaction_remove")
 
 
 # Create a command group for /wheels using app_commands.Group for compatibility
@@ -1710,27 +2257,181 @@ async def wheels_create(interaction: discord.Interaction, text: str):
         "emoji": emoji,
         "created_at": int(time.time()),
     }
+    _host_wheels[(msg.channel.id, host.id)] = msg.id
 
     await interaction.followup.send(f"Wheel created. React with {emoji} to join.", ephemeral=True)
 
 
+@functools.lru_cache(maxsize=64)
+def _wheel_palette(num: int) -> tuple[tuple[int, int, int], ...]:
+    """Distinct wedge colors for a wheel with num slices (HSV spacing for good contrast)."""
+    colors = []
+    for i in range(num):
+        h = float(i) / max(1, num)
+        r, g, b = colorsys.hsv_to_rgb(h, 0.85, 0.95)
+        colors.append((int(r*255), int(g*255), int(b*255)))
+    return tuple(colors)
+
+
+# each entry is a full RGBA wheel (~2.5MB at 800px), so keep only the most recent few
+@functools.lru_cache(maxsize=8)
+def _build_wheel_image(names: tuple[str, ...], size: int):
+    """Wedges + name labels for a wheel, unrotated. Cached per (names, size) so repeat spins
+    with the same participants skip the drawing; callers must not draw on the result.
+    """
+    center = size // 2
+    num = len(names)
+    colors = _wheel_palette(num)
+
+    # base wheel image (transparent background)
+    base = Image.new("RGBA", (size, size), (255,255,255,0))
+    bdraw = ImageDraw.Draw(base)
+    bbox = (20, 20, size-20, size-20)
+    bdraw.ellipse(bbox, fill=(240,240,240), outline=(0,0,0))
+
+    # draw wedges on base
+    for i, nm in enumerate(names):
+        start_angle = 360.0 * i / num
+        end_angle = 360.0 * (i+1) / num
+        color = colors[i % len(colors)]
+        bdraw.pieslice(bbox, start=-start_angle, end=-end_angle, fill=color, outline=(255,255,255))
+
+    # draw center circle
+    center_radius = 80
+    bdraw.ellipse((center-center_radius, center-center_radius, center+center_radius, center+center_radius), fill=(255,255,255), outline=(0,0,0))
+
+    # render names around the wheel on a separate layer to avoid distortion when rotating
+    labels = Image.new("RGBA", (size, size), (255,255,255,0))
+    ldraw = ImageDraw.Draw(labels)
+    # adaptive font sizing: favour larger font when fewer slices
+    font = _get_font(max(12, int(220 / max(4, num))))
+
+    # label centres sit on a fixed radius at each wedge's mid angle
+    r = int((size/2 - 60) * 0.8)
+    step = 2 * math.pi / num
+    for i, nm in enumerate(names):
+        theta = (i + 0.5) * step
+        tx = int(center - r * math.sin(theta))
+        ty = int(center - r * math.cos(theta))
+        text = nm
+        # truncate if too long
+        max_len = 22
+        if len(text) > max_len:
+            text = text[:max_len-1] + "…"
+        tw, th = _text_size(font, text)
+        # draw a semi-transparent rectangle behind the text to ensure readability over wedge colors
+        pad_x = 10
+        pad_y = 6
+        rect_left = tx - tw//2 - pad_x
+        rect_top = ty - th//2 - pad_y
+        rect_right = tx + tw//2 + pad_x
+        rect_bottom = ty + th//2 + pad_y
+        # ensure coordinates are integers
+        rect = (int(rect_left), int(rect_top), int(rect_right), int(rect_bottom))
+        try:
+            ldraw.rectangle(rect, fill=(255,255,255,220))
+        except Exception:
+            # fallback if alpha not supported
+            ldraw.rectangle(rect, fill=(255,255,255))
+        # draw centered text on top of the rectangle
+        ldraw.text((tx - tw//2, ty - th//2), text, font=font, fill=(0,0,0))
+
+    # blend only the part of the label layer that has ink, in place on base
+    ink = labels.getbbox()
+    if ink:
+        base.alpha_composite(labels, dest=ink[:2], source=ink)
+    return base
+
+
+
+@functools.lru_cache(maxsize=1)
+def _wheel_pointer():
+    """The pointer triangle, rasterized once and pasted onto every frame."""
+    sprite = Image.new("RGBA", (49, 55), (0, 0, 0, 0))
+    ImageDraw.Draw(sprite).polygon([(0, 0), (48, 0), (24, 54)], fill=(30,30,30))
+    return sprite
+
+
+def _rotation_matrix(degrees: float, cx: float, cy: float) -> tuple[float, ...]:
+    """Inverse affine matrix for a counter-clockwise rotation about (cx, cy), as Image.rotate builds it."""
+    rad = math.radians(degrees)
+    cos_a, sin_a = math.cos(rad), math.sin(rad)
+    return (cos_a, -sin_a, cx - cos_a * cx + sin_a * cy,
+            sin_a, cos_a, cy - sin_a * cx - cos_a * cy)
+
+
+def _render_wheel_gif(names: list[str], winner_index: int, winner_name: str) -> io.BytesIO:
+    """Draw the spinning-wheel GIF landing on names[winner_index]. CPU-bound: run it in an executor."""
+    size = 800
+    center = size // 2
+    num = len(names)
+    wheel_img = _build_wheel_image(tuple(names), size)
+
+    # gif frames: rotate the wheel so that it spins and lands on winner
+    # compute target angle so that winner segment mid angle ends at top (0 degrees)
+    target_mid = (360.0 * winner_index / num + 360.0 * (winner_index+1) / num) / 2
+    # the wheel rotation is negative of segment angle (since pointer at top)
+    target_rotation = -target_mid
+
+    # generate frames: start from random offset and spin multiple turns decelerating
+    start_rotation = random.uniform(0, 360)
+    total_turns = random.uniform(3, 6)  # full rotations
+    final_rotation = start_rotation + total_turns * 360 + target_rotation
+
+    frame_count = 40
+    # wheel angle for every frame, easing out (cubic) so the spin decelerates
+    spin = final_rotation - start_rotation
+    rotations = [start_rotation + spin * (1 - (1 - f / (frame_count - 1)) ** 3) for f in range(frame_count)]
+    font_sm = _get_font(28)
+    winner_text = f"Winner: {winner_name}"
+
+    def _frames():
+        # one canvas (with pointer and label area) reused for every frame; quantize() copies it out
+        # opaque, so RGB: a byte less per pixel and quantize() takes it directly
+        canvas = Image.new("RGB", (size, size+80), (255,255,255))
+        cdraw = ImageDraw.Draw(canvas)
+        pointer = _wheel_pointer()
+        # every frame is mapped onto the first frame's palette: one octree pass instead of a
+        # palette search per frame, and consistent indices compress better in the GIF
+        palette_img = None
+        for f, rot in enumerate(rotations):
+            # rotate wheel_img around center (bilinear: ~2x cheaper than bicubic, same look once quantized)
+            frame = wheel_img.transform((size, size), Image.AFFINE, _rotation_matrix(rot, center, center), resample=Image.BILINEAR)
+            # reset the wheel area, then lay the rotated wheel and the pointer on top
+            canvas.paste((255,255,255), (0, 0, size, size))
+            canvas.paste(frame, (0,0), frame)
+            canvas.paste(pointer, (center-24, 6), pointer)
+            if f == frame_count - 1:
+                # attach winner label to final frame
+                wtw, _ = _text_size(font_sm, winner_text)
+                cdraw.rectangle(((size- wtw)//2 - 10, size - 60, (size+wtw)//2 + 10, size - 10), fill=(255,255,255))
+                cdraw.text(((size-wtw)/2, size-55), winner_text, fill=(0,0,0), font=font_sm)
+            if palette_img is None:
+                palette_img = canvas.quantize(colors=64, method=Image.Quantize.FASTOCTREE)
+            yield canvas.quantize(palette=palette_img, dither=Image.Dither.NONE)
+
+    # encode the GIF in memory as frames are produced; duration per frame in ms (40 frames x 125ms ~ 5 seconds)
+    buf = io.BytesIO()
+    frames = _frames()
+    first = next(frames)
+    # Pillow already crops each frame to the region that changed; optimize=True (per-frame palette
+    # trimming) and disposal=2 both made the wheel GIF ~3-10% larger, so they stay off
+    first.save(buf, format="GIF", save_all=True, append_images=frames, duration=125, loop=0, optimize=False)
+    buf.seek(0)
+    return buf
+
+
 @wheels_group.command(name="start", description="Start the wheel and pick a random winner from reactors")
 async def wheels_start(interaction: discord.Interaction):
     # Validate context
     # The command should be used after creating a wheel; find the most recent wheel by this host in the channel
     channel = interaction.channel
     host = interaction.user
-    # find a wheel in this channel where host matches
+    # find this host's wheel in this channel (indexed at creation, no message fetch needed)
     candidate = None
-    for msg_id, meta in wheels_meta.items():
-        if meta.get("host") == host.id:
-            # ensure message is in same channel
-            try:
-                m = await channel.fetch_message(msg_id)
-            except Exception:
-                continue
-            candidate = (msg_id, m, meta)
-            break
+    msg_id = _host_wheels.get((channel.id, host.id))
+    if msg_id is not None and msg_id in wheels_meta:
+        candidate = (msg_id, wheels_meta[msg_id])
 
     if not candidate:
         try:
@@ -1742,7 +2443,7 @@ async def wheels_start(interaction: discord.Interaction):
                 pass
         return
 
-    msg_id, message_obj, meta = candidate
+    msg_id, meta = candidate
     participants = list(wheels.get(msg_id, set()))
     if not participants:
         try:
@@ -1776,16 +2477,17 @@ async def wheels_start(interaction: discord.Interaction):
     else:
         chosen_participants = participants[:]
 
-    names = [f"{(await bot.fetch_user(uid)).display_name}" for uid in chosen_participants]
-
     # Choose winner among full participants (so image will point to one of shown participants if possible)
     winner_id = random.choice(participants)
+    # one lookup pass for every name we may show (cache first, concurrent fetch for the rest)
+    name_by_id = await resolve_display_names(chosen_participants + [winner_id], interaction.guild)
+    names = [name_by_id[uid] for uid in chosen_participants]
     # If winner is not in the displayed slice, try to map it to a shown one by replacing a random slice
     if winner_id not in chosen_participants and len(chosen_participants) < len(participants):
         # replace a random slot with the winner so it's visible
         replace_idx = random.randrange(len(chosen_participants))
         chosen_participants[replace_idx] = winner_id
-        names[replace_idx] = (await bot.fetch_user(winner_id)).display_name
+        names[replace_idx] = name_by_id[winner_id]
     # Now find index of winner in chosen_participants (should exist)
     try:
         winner_index = chosen_participants.index(winner_id)
@@ -1794,187 +2496,27 @@ async def wheels_start(interaction: discord.Interaction):
         winner_index = random.randrange(len(chosen_participants))
         winner_id = chosen_participants[winner_index]
 
-    # Generate animated GIF wheel using Pillow
-    try:
-        from PIL import Image, ImageDraw, ImageFont
-    except Exception:
-        Image = None
-
-    img_path = None
-    if Image:
+    # Generate animated GIF wheel using Pillow (imported once at module load)
+    gif_buf = None
+    if _PIL_OK:
         try:
-            size = 800
-            center = size // 2
-            num = len(names)
-            # generate distinct colors per participant using HSV spacing for good contrast
-            try:
-                import colorsys
-                colors = []
-                for i in range(num):
-                    h = float(i) / max(1, num)
-                    s = 0.85
-                    v = 0.95
-                    r, g, b = colorsys.hsv_to_rgb(h, s, v)
-                    colors.append((int(r*255), int(g*255), int(b*255)))
-            except Exception:
-                # fallback to a small palette repeated if colorsys isn't available
-                colors = [
-                    (255,99,71),(60,179,113),(65,105,225),(238,130,238),(255,215,0),(70,130,180),
-                    (255,165,0),(144,238,144),(199,21,133),(30,144,255),(218,165,32),(152,251,152)
-                ]
-
-            # base wheel image (transparent background)
-            base = Image.new("RGBA", (size, size), (255,255,255,0))
-            bdraw = ImageDraw.Draw(base)
-            bbox = (20, 20, size-20, size-20)
-            bdraw.ellipse(bbox, fill=(240,240,240), outline=(0,0,0))
-
-            # draw wedges on base
-            for i, nm in enumerate(names):
-                start_angle = 360.0 * i / num
-                end_angle = 360.0 * (i+1) / num
-                color = colors[i % len(colors)]
-                bdraw.pieslice(bbox, start=-start_angle, end=-end_angle, fill=color, outline=(255,255,255))
-
-            # draw center circle
-            center_radius = 80
-            bdraw.ellipse((center-center_radius, center-center_radius, center+center_radius, center+center_radius), fill=(255,255,255), outline=(0,0,0))
-
-            # render names around the wheel on a separate layer to avoid distortion when rotating
-            labels = Image.new("RGBA", (size, size), (255,255,255,0))
-            ldraw = ImageDraw.Draw(labels)
-            # adaptive font sizing: favour larger font when fewer slices
-            try:
-                base_font_size = max(12, int(220 / max(4, num)))
-                font = ImageFont.truetype("DejaVuSans-Bold.ttf", base_font_size)
-            except Exception:
-                font = ImageFont.load_default()
-
-            for i, nm in enumerate(names):
-                start_angle = 360.0 * i / num
-                end_angle = 360.0 * (i+1) / num
-                mid_angle = (start_angle + end_angle) / 2
-                r = int((size/2 - 60) * 0.8)
-                theta = (mid_angle) * (math.pi/180.0)
-                tx = int(center + r * -math.sin(theta))
-                ty = int(center + r * -math.cos(theta))
-                text = nm
-                # truncate if too long
-                max_len = 22
-                if len(text) > max_len:
-                    text = text[:max_len-1] + "…"
-                # compute text size robustly: prefer draw.textbbox, fall back to font.getsize or font.getbbox
-                try:
-                    bbox = ldraw.textbbox((0, 0), text, font=font)
-                    tw = bbox[2] - bbox[0]
-                    th = bbox[3] - bbox[1]
-                except Exception:
-                    try:
-                        tw, th = font.getsize(text)
-                    except Exception:
-                        try:
-                            bbox2 = font.getbbox(text)
-                            tw = bbox2[2] - bbox2[0]
-                            th = bbox2[3] - bbox2[1]
-                        except Exception:
-                            tw, th = (0, 0)
-                # draw a semi-transparent rectangle behind the text to ensure readability over wedge colors
-                pad_x = 10
-                pad_y = 6
-                rect_left = tx - tw//2 - pad_x
-                rect_top = ty - th//2 - pad_y
-                rect_right = tx + tw//2 + pad_x
-                rect_bottom = ty + th//2 + pad_y
-                # ensure coordinates are integers
-                rect = (int(rect_left), int(rect_top), int(rect_right), int(rect_bottom))
-                try:
-                    ldraw.rectangle(rect, fill=(255,255,255,220))
-                except Exception:
-                    # fallback if alpha not supported
-                    ldraw.rectangle(rect, fill=(255,255,255))
-                # draw centered text on top of the rectangle
-                ldraw.text((tx - tw//2, ty - th//2), text, font=font, fill=(0,0,0))
-
-            # combine base + labels into a single wheel image
-            wheel_img = Image.alpha_composite(base, labels)
-
-            # gif frames: rotate the wheel so that it spins and lands on winner
-            # compute target angle so that winner segment mid angle ends at top (0 degrees)
-            target_mid = (360.0 * winner_index / num + 360.0 * (winner_index+1) / num) / 2
-            # the wheel rotation is negative of segment angle (since pointer at top)
-            target_rotation = -target_mid
-
-            # generate frames: start from random offset and spin multiple turns decelerating
-            start_rotation = random.uniform(0, 360)
-            total_turns = random.uniform(3, 6)  # full rotations
-            final_rotation = start_rotation + total_turns * 360 + target_rotation
-
-            frames = []
-            frame_count = 40
-            for f in range(frame_count):
-                t = f / (frame_count - 1)
-                # ease out cubic
-                ease = 1 - pow(1 - t, 3)
-                rot = start_rotation + (final_rotation - start_rotation) * ease
-                # rotate wheel_img around center
-                frame = wheel_img.rotate(rot, resample=Image.BICUBIC, center=(center, center))
-                # create full canvas with pointer and label area
-                canvas = Image.new("RGBA", (size, size+80), (255,255,255,255))
-                canvas.paste(frame, (0,0), frame)
-                cdraw = ImageDraw.Draw(canvas)
-                # draw pointer at top center
-                pointer = [(center-24, 6), (center+24, 6), (center, 60)]
-                cdraw.polygon(pointer, fill=(30,30,30))
-                # draw winner label placeholder (will fill after frames)
-                frames.append(canvas.convert("P"))
-
-            # attach winner label to final frame
-            try:
-                font_sm = ImageFont.truetype("DejaVuSans-Bold.ttf", 28)
-            except Exception:
-                font_sm = ImageFont.load_default()
-            winner_text = f"Winner: { (await bot.fetch_user(winner_id)).display_name }"
-            final = frames[-1].convert("RGBA")
-            fdraw = ImageDraw.Draw(final)
-            # compute winner text size robustly: prefer textbbox, then font.getsize/getbbox
-            try:
-                bbox = fdraw.textbbox((0, 0), winner_text, font=font_sm)
-                wtw = bbox[2] - bbox[0]
-                wth = bbox[3] - bbox[1]
-            except Exception:
-                try:
-                    wtw, wth = font_sm.getsize(winner_text)
-                except Exception:
-                    try:
-                        bbox2 = font_sm.getbbox(winner_text)
-                        wtw = bbox2[2] - bbox2[0]
-                        wth = bbox2[3] - bbox2[1]
-                    except Exception:
-                        wtw, wth = (0, 0)
-            fdraw.rectangle(((size- wtw)//2 - 10, size - 60, (size+wtw)//2 + 10, size - 10), fill=(255,255,255,200))
-            fdraw.text(((size-wtw)/2, size-55), winner_text, fill=(0,0,0), font=font_sm)
-            frames[-1] = final.convert("P")
-
-            # save GIF
-            img_dir = os.path.join(os.path.dirname(__file__), ".temp")
-            os.makedirs(img_dir, exist_ok=True)
-            img_path = os.path.join(img_dir, f"wheel_{int(time.time())}.gif")
-            # duration per frame in ms; with frame_count ~40 and 125ms gives ~5 seconds
-            frames[0].save(img_path, save_all=True, append_images=frames[1:], duration=125, loop=0, optimize=False)
-        except Exception as e:
-            print("Failed to generate wheel image/gif:", e)
-            img_path = None
+            loop = asyncio.get_running_loop()
+            winner_name = name_by_id.get(winner_id, names[winner_index])
+            gif_buf = await loop.run_in_executor(None, _render_wheel_gif, names, winner_index, winner_name)
+        except Exception:
+            logging.exception("Failed to generate wheel image/gif")
+            gif_buf = None
 
     # send the generated image (or fallback text) and wait ~5 seconds
     try:
-        if img_path and os.path.isfile(img_path):
-            file = discord.File(img_path)
+        if gif_buf is not None:
+            file = discord.File(gif_buf, filename="wheel.gif")
             await channel.send(content="The wheel spins... 🎡", file=file)
         else:
             # fallback simple announcement
             names_mention = " | ".join([f"<@{uid}>" for uid in chosen_participants])
             # if Pillow was missing, inform that image generation is unavailable
-            if Image is None:
+            if not _PIL_OK:
                 await channel.send("Pillow (PIL) not available on this host — wheel image cannot be generated. Installing Pillow will enable a visual wheel.")
             await channel.send("Spinning: " + names_mention)
     except Exception:
@@ -1994,11 +2536,7 @@ async def wheels_start(interaction: discord.Interaction):
 
     # Optionally record a win in DB (global)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("INSERT INTO wins_global(user_id, wins) VALUES (?, 1) ON CONFLICT(user_id) DO UPDATE SET wins = wins + 1", (winner_id,))
-        conn.commit()
-        conn.close()
+        await run_db(record_global_win, winner_id)
     except Exception:
         pass
 
@@ -2011,7 +2549,7 @@ async def wheels_start(interaction: discord.Interaction):
                 except Exception:
                     pass
             else:
-                add_ghosts(winner_id, ghosts_awarded)
+                await run_db(add_ghosts, winner_id, ghosts_awarded)
                 try:
                     await channel.send(f"{GHOST_EMOJI} {ghosts_awarded} ghosts have been awarded to {winner_mention}!")
                 except Exception:
@@ -2019,7 +2557,7 @@ async def wheels_start(interaction: discord.Interaction):
         except Exception:
             # fallback: award normally
             try:
-                add_ghosts(winner_id, ghosts_awarded)
+                await run_db(add_ghosts, winner_id, ghosts_awarded)
             except Exception:
                 pass
     except Exception:
@@ -2028,41 +2566,86 @@ async def wheels_start(interaction: discord.Interaction):
     # cleanup wheel data
     wheels.pop(msg_id, None)
     wheels_meta.pop(msg_id, None)
+    if _host_wheels.get((channel.id, host.id)) == msg_id:
+        _host_wheels.pop((channel.id, host.id), None)
 
 
 # ---------------- HAUNTED HOUSE (House) - Prototype ----------------
-from uuid import uuid4
-from typing import Optional
-
 # In-memory storage for house games: game id string -> HouseGame (games are inferred by channel or host)
 house_games: dict[str, dict] = {}
+# secondary indices so the finders below are dict lookups instead of scans over every game
+house_games_by_channel: dict[int, str] = {}  # channel id -> game id
+# the id collections are insertion-ordered dicts (values unused) so lookups return the oldest
+# match first, like the old scan over house_games did
+house_games_by_host: dict[int, dict[str, None]] = {}  # host id -> ids of every game they host
+pending_games_by_user: dict[int, dict[str, None]] = {}  # user id -> ids of games they're invited to but haven't accepted
+
+
+def add_pending_invite(uid: int, game_id: str):
+    pending_games_by_user.setdefault(uid, {})[game_id] = None
+
+
+def drop_pending_invite(uid: int, game_id: str):
+    pending = pending_games_by_user.get(uid)
+    if pending is not None:
+        pending.pop(game_id, None)
+        if not pending:
+            pending_games_by_user.pop(uid, None)
+
+
+def forget_house_game(game: "HouseGame"):
+    """Remove a game from house_games and every index."""
+    house_games.pop(game.id, None)
+    if game.channel_id is not None and house_games_by_channel.get(game.channel_id) == game.id:
+        house_games_by_channel.pop(game.channel_id, None)
+    hosted = house_games_by_host.get(game.host_id)
+    if hosted is not None:
+        hosted.pop(game.id, None)
+        if not hosted:
+            house_games_by_host.pop(game.host_id, None)
+    for uid in game.players:
+        drop_pending_invite(uid, game.id)
 
 
 def find_game_by_channel(channel: discord.abc.Messageable | None) -> Optional["HouseGame"]:
     if not channel:
         return None
-    for g in house_games.values():
-        if g.channel_id == getattr(channel, 'id', None):
+    gid = house_games_by_channel.get(getattr(channel, 'id', None))
+    return house_games.get(gid) if gid else None
+
+
+def find_game_by_host(user: discord.User | discord.Member) -> Optional["HouseGame"]:
+    for gid in house_games_by_host.get(getattr(user, 'id', None), ()):
+        g = house_games.get(gid)
+        if g is not None:
             return g
     return None
 
 
 def find_lobby_game_by_host(user: discord.User | discord.Member) -> Optional["HouseGame"]:
-    for g in house_games.values():
-        if g.host_id == getattr(user, 'id', None) and g.state == 'lobby':
+    for gid in house_games_by_host.get(getattr(user, 'id', None), ()):
+        g = house_games.get(gid)
+        if g is not None and g.state == 'lobby':
             return g
     return None
 
 
 def find_pending_game_for_player(user: discord.User | discord.Member) -> Optional["HouseGame"]:
-    # find a game where the user is invited but not accepted yet, prefer lobby
-    for g in house_games.values():
-        meta = g.players.get(getattr(user, 'id', None))
-        if meta is not None and not meta.get('accepted'):
+    # find a game where the user is invited but not accepted yet
+    for gid in pending_games_by_user.get(getattr(user, 'id', None), ()):
+        g = house_games.get(gid)
+        if g is not None:
             return g
     return None
 
 
+# exits for each 4-bit edge mask (bit0 up, bit1 down, bit2 left, bit3 right)
+_MOVE_NAMES = tuple(
+    tuple(name for bit, name in enumerate(("up", "down", "left", "right")) if mask >> bit & 1)
+    for mask in range(16)
+)
+
+
 class HouseGame:
     def __init__(self, guild: discord.Guild, host_id: int, mode: str = "solo", max_players: int = 1):
         self.id = str(uuid4())[:8]
@@ -2074,45 +2657,61 @@ class HouseGame:
         self.players: dict[int, dict] = {host_id: {"accepted": True, "hp": 10, "inventory": [], "position": None}}
         self.state = "lobby"  # lobby | started | finished
         self.channel_id: int | None = None
+        # the private channel object itself, kept from creation so turns don't re-resolve it
+        self.channel: discord.TextChannel | None = None
         self.turn_index = 0
         self.map = {}  # simple map placeholder
+        self.edge_mask: list[int] = []
         self.lock = asyncio.Lock()
+        # set by /house action once the current player has acted, so the turn loop moves on right away
+        self.turn_event = asyncio.Event()
         # internal flags to avoid spamming prompts
         self._sent_intro = False
         self._last_prompt_turn: int | None = None
+        # lines (e.g. eliminations) held back to ride along with the next message to the channel
+        self._pending_announcements: list[str] = []
 
     def init_map(self, width: int = 3, height: int = 3):
         """Initialize a simple rectangular map and place players in the center by default."""
-        self.map = {"width": width, "height": height, "rooms": {}}
-        for x in range(width):
-            for y in range(height):
+        # rooms are stored row-major in a flat list: room (x, y) is rooms[y * width + x]
+        rooms = []
+        for y in range(height):
+            for x in range(width):
                 # simple flavour descriptions; could be expanded later
                 desc = f"A creaky room at ({x+1},{y+1}) with dusty floor and old wallpaper."
                 # randomly vary a little
                 if (x + y) % 3 == 0:
                     desc = f"A cold room at ({x+1},{y+1}) with a faint whispering sound."
-                self.map["rooms"][(x, y)] = {"desc": desc, "items": []}
+                rooms.append({"desc": desc, "items": []})
+        self.map = {"width": width, "height": height, "rooms": rooms}
+        # which exits each room has, in the same row-major order as rooms
+        self.edge_mask = [
+            (y > 0) | (y < height - 1) << 1 | (x > 0) << 2 | (x < width - 1) << 3
+            for y in range(height) for x in range(width)
+        ]
         # starting position: center
         sx = width // 2
         sy = height // 2
         for uid in list(self.players.keys()):
             self.players[uid]["position"] = (sx, sy)
 
+    def get_channel(self) -> discord.abc.GuildChannel | None:
+        """The game's private channel: the object stored at creation, else looked up by id."""
+        if self.channel is None and self.channel_id is not None and self.guild is not None:
+            self.channel = self.guild.get_channel(self.channel_id)
+        return self.channel
+
+    def room_at(self, x: int, y: int) -> dict | None:
+        if not self.map:
+            return None
+        return self.map["rooms"][y * self.map["width"] + x]
+
     def valid_moves_for(self, uid: int) -> list[str]:
         pos = self.players.get(uid, {}).get("position")
         if not pos or not self.map:
             return []
         x, y = pos
-        moves = []
-        if y > 0:
-            moves.append("up")
-        if y < self.map.get("height", 0) - 1:
-            moves.append("down")
-        if x > 0:
-            moves.append("left")
-        if x < self.map.get("width", 0) - 1:
-            moves.append("right")
-        return moves
+        return list(_MOVE_NAMES[self.edge_mask[y * self.map["width"] + x]])
 
     def move_player(self, uid: int, direction: str) -> bool:
         pos = self.players.get(uid, {}).get("position")
@@ -2163,6 +2762,7 @@ async def house_create(interaction: discord.Interaction, mode: str = "solo", max
     # create game object
     game = HouseGame(guild=interaction.guild, host_id=interaction.user.id, mode=mode, max_players=max_players)
     house_games[game.id] = game
+    house_games_by_host.setdefault(game.host_id, {})[game.id] = None
 
     # create a private text channel for the game, visible only to host and bot for now
     overwrites = {
@@ -2173,14 +2773,16 @@ async def house_create(interaction: discord.Interaction, mode: str = "solo", max
     try:
         ch = await interaction.guild.create_text_channel(name=f"house-{game.id}", overwrites=overwrites, reason="Private House game channel")
         game.channel_id = ch.id
+        game.channel = ch
+        house_games_by_channel[ch.id] = game.id
     except discord.Forbidden:
         await interaction.response.send_message("Bot lacks permission to create channels. Please grant Manage Channels.", ephemeral=True)
         # clean up game
-        house_games.pop(game.id, None)
+        forget_house_game(game)
         return
     except Exception as e:
         await interaction.response.send_message(f"Failed to create channel: {e}", ephemeral=True)
-        house_games.pop(game.id, None)
+        forget_house_game(game)
         return
 
     # initialize a small map for the house
@@ -2285,12 +2887,13 @@ async def house_invite(interaction: discord.Interaction, user: str):
         return
     # add invited player as not accepted yet
     game.players[target_member.id] = {"accepted": False, "hp": 10, "inventory": [], "position": None}
+    add_pending_invite(target_member.id, game.id)
 
     # DM the invite with instructions
     try:
         dm = await target_member.create_dm()
         try:
-            await dm.send(f"You have been invited to the House game by {interaction.user.display_name}. To accept, run `/house accept` here or on the server. The game channel will be {interaction.guild.get_channel(game.channel_id).mention} once added.")
+            await dm.send(f"You have been invited to the House game by {interaction.user.display_name}. To accept, run `/house accept` here or on the server. The game channel will be {game.get_channel().mention} once added.")
         except Exception:
             pass
     except Exception:
@@ -2312,9 +2915,10 @@ async def house_accept(interaction: discord.Interaction):
         return
     # mark accepted
     game.players[interaction.user.id]["accepted"] = True
+    drop_pending_invite(interaction.user.id, game.id)
     # give channel permission
     try:
-        ch = game.guild.get_channel(game.channel_id)
+        ch = game.get_channel()
         if ch:
             await ch.set_permissions(interaction.user, view_channel=True, send_messages=True)
     except Exception:
@@ -2343,7 +2947,7 @@ async def house_start(interaction: discord.Interaction):
     # lock and mark started
     game.state = "started"
     # ensure all accepted players have channel perms
-    ch = game.guild.get_channel(game.channel_id) if game.channel_id else None
+    ch = game.get_channel()
     if ch:
         for uid in accepted:
             try:
@@ -2359,7 +2963,7 @@ async def house_start(interaction: discord.Interaction):
         pos = game.players[uid].get("position")
         if pos and game.map:
             x, y = pos
-            room = game.map["rooms"].get((x, y))
+            room = game.room_at(x, y)
             intro_lines.append(f"{f'<@{uid}>'} starts in room ({x+1},{y+1}): {room.get('desc') if room else 'An empty room.'}")
     intro_lines.append("When it's your turn you'll receive a prompt in this channel. Use `/house action move <direction>` or `/house action explore` or `/house action search`. Directions: up/down/left/right.")
     try:
@@ -2420,7 +3024,7 @@ async def house_action(interaction: discord.Interaction, action: str = "", targe
         if tnorm in dir_aliases:
             action = "move"
             target = tnorm
-    ch = game.guild.get_channel(game.channel_id) if game.channel_id else None
+    ch = game.get_channel()
 
     # helper to send narration to game channel and ephemeral ack
     async def narrate(text: str):
@@ -2449,7 +3053,7 @@ async def house_action(interaction: discord.Interaction, action: str = "", targe
         pos = game.players[interaction.user.id].get("position")
         if pos and game.map:
             x, y = pos
-            room = game.map["rooms"].get((x, y), {})
+            room = game.room_at(x, y) or {}
             # show description and items, and available moves
             items = room.get("items", [])
             items_text = ", ".join(items) if items else "none"
@@ -2476,7 +3080,7 @@ async def house_action(interaction: discord.Interaction, action: str = "", targe
         moved = game.move_player(interaction.user.id, dir)
         if moved:
             pos = game.players[interaction.user.id]["position"]
-            room = game.map["rooms"].get(pos, {})
+            room = game.room_at(*pos) or {}
             text = f"You move {dir} to room ({pos[0]+1},{pos[1]+1}). {room.get('desc', '')}"
         else:
             moves = game.valid_moves_for(interaction.user.id)
@@ -2508,6 +3112,7 @@ async def house_action(interaction: discord.Interaction, action: str = "", targe
     game.turn_index = (game.turn_index + 1) % max(1, len(accepted))
     # reset prompt tracking so next turn will show prompt for new player
     game._last_prompt_turn = None
+    game.turn_event.set()
 
 
 @house_group.command(name="move", description="Shortcut to move in the current House game (direction: up/down/left/right)")
@@ -2529,7 +3134,7 @@ async def house_status(interaction: discord.Interaction):
         await interaction.response.send_message("Game not found. If you're in the game's private channel you can omit the game id.", ephemeral=True)
         return
     players = "\n".join([f"<@{uid}> — HP: {meta['hp']} — Accepted: {meta['accepted']} — Pos: { (meta['position'][0]+1, meta['position'][1]+1) if meta.get('position') else 'N/A'}" for uid, meta in game.players.items()])
-    ch = game.guild.get_channel(game.channel_id) if game.channel_id else None
+    ch = game.get_channel()
     await interaction.response.send_message(f"Game {game.id}\nMode: {game.mode}\nState: {game.state}\nChannel: {ch.mention if ch else 'N/A'}\nPlayers:\n{players}", ephemeral=True)
 
 
@@ -2543,19 +3148,18 @@ async def house_leave(interaction: discord.Interaction):
         await interaction.response.send_message("You are not in this game.", ephemeral=True)
         return
     # remove player and revoke channel permission
-    try:
-        ch = game.guild.get_channel(game.channel_id)
-        if ch:
-            await ch.set_permissions(interaction.user, overwrite=None)
-    except Exception:
-        pass
+    ch = game.get_channel()
+    if ch:
+        user = interaction.user
+        queue_discord_job(lambda: ch.set_permissions(user, overwrite=None), name=f"house-leave-{game.id}")
     game.players.pop(interaction.user.id, None)
+    drop_pending_invite(interaction.user.id, game.id)
     await interaction.response.send_message(f"You left game {game.id}.", ephemeral=True)
 
 
 @house_group.command(name="end", description="End a House game and remove the private channel (host only).")
 async def house_end(interaction: discord.Interaction):
-    game = find_game_by_channel(interaction.channel) or next((g for g in house_games.values() if g.host_id == interaction.user.id), None)
+    game = find_game_by_channel(interaction.channel) or find_game_by_host(interaction.user)
     if not game:
         await interaction.response.send_message("Game not found. If you're in the game's private channel you can omit the game id.", ephemeral=True)
         return
@@ -2563,35 +3167,22 @@ async def house_end(interaction: discord.Interaction):
         await interaction.response.send_message("Only the host or a manager can end the game.", ephemeral=True)
         return
     # Respond first so the interaction is acknowledged even if the channel is removed
-    try:
-        if not interaction.response.is_done():
-            await interaction.response.send_message("Game ended and cleaned up.", ephemeral=True)
-        else:
-            await safe_reply(interaction, "Game ended and cleaned up.")
-    except Exception:
-        # fallback to safe_reply
-        try:
-            await safe_reply(interaction, "Game ended and cleaned up.")
-        except Exception:
-            pass
+    # (safe_reply picks response vs followup itself and never raises)
+    await safe_reply(interaction, "Game ended and cleaned up.")
 
-    # delete channel after acknowledging the interaction
-    try:
-        ch = game.guild.get_channel(game.channel_id)
-        if ch:
-            await ch.delete(reason="House game ended")
-    except Exception:
-        # ignore deletion errors (e.g., already deleted)
-        pass
+    # delete channel after acknowledging the interaction (errors such as already-deleted are only logged)
+    ch = game.get_channel()
+    if ch:
+        queue_discord_job(lambda: ch.delete(reason="House game ended"), name=f"house-end-{game.id}")
 
     # cleanup game from memory
-    house_games.pop(game.id, None)
+    forget_house_game(game)
 
 
 async def run_house_game(game: HouseGame):
     """Simple loop that posts turn prompts in the game's private channel."""
     try:
-        ch = game.guild.get_channel(game.channel_id) if game.channel_id else None
+        ch = game.get_channel()
         if not ch:
             return
         # use per-game flags to avoid spamming prompts
@@ -2602,57 +3193,68 @@ async def run_house_game(game: HouseGame):
         while game.state == "started":
             accepted = game.accepted_players()
             if not accepted:
-                await ch.send("No active players remain. Ending game.")
+                game._pending_announcements.append("No active players remain. Ending game.")
+                await ch.send("\n".join(game._pending_announcements))
+                game._pending_announcements.clear()
                 break
             current_uid = accepted[game.turn_index % len(accepted)]
-            # Build a concise prompt: mention player, show HP, position and valid moves
             meta = game.players.get(current_uid, {})
-            hp = meta.get("hp", 0)
-            pos = meta.get("position")
-            pos_text = f"({pos[0]+1},{pos[1]+1})" if pos else "N/A"
-            moves = game.valid_moves_for(current_uid)
-            moves_text = ", ".join(moves) if moves else "none"
-            prompt_lines = [f"It's <@{current_uid}>'s turn — HP: {hp} — Position: {pos_text}.", f"Valid moves: {moves_text}."]
-            # only show brief guidance once at start to avoid spam
-            if not game._sent_intro:
-                prompt_lines.append("You can use `/house action move <direction>`, `/house action explore` or `/house action search`. You may omit the game id when in this channel.")
-                game._sent_intro = True
-
-            # avoid repeating the exact same prompt for the same player
-            if game._last_prompt_turn == game.turn_index:
-                # skip sending duplicate prompt
-                pass
-            else:
+            # only build and send the prompt once per turn
+            if game._last_prompt_turn != game.turn_index:
+                # Build a concise prompt: mention player, show HP, position and valid moves
+                hp = meta.get("hp", 0)
+                pos = meta.get("position")
+                pos_text = f"({pos[0]+1},{pos[1]+1})" if pos else "N/A"
+                moves = game.valid_moves_for(current_uid)
+                moves_text = ", ".join(moves) if moves else "none"
+                prompt_lines = [f"It's <@{current_uid}>'s turn — HP: {hp} — Position: {pos_text}.", f"Valid moves: {moves_text}."]
+                # only show brief guidance once at start to avoid spam
+                if not game._sent_intro:
+                    prompt_lines.append("You can use `/house action move <direction>`, `/house action explore` or `/house action search`. You may omit the game id when in this channel.")
+                    game._sent_intro = True
+                # fold any queued announcements into the prompt so it's one API call, not two
+                message_text = "\n".join(game._pending_announcements + [" ".join(prompt_lines)])
+                game._pending_announcements.clear()
                 try:
-                    await ch.send(" ".join(prompt_lines))
+                    await ch.send(message_text)
                 except Exception:
                     pass
                 game._last_prompt_turn = game.turn_index
 
-            # wait a limited time for the turn to be used; if no action, auto-pass
-            await asyncio.sleep(20)
-
-            # check if player still alive
-            if game.players.get(current_uid, {}).get("hp", 0) <= 0:
-                # mark removed and announce
-                game.players[current_uid]["accepted"] = False
-                try:
-                    await ch.send(f"<@{current_uid}> has fallen and is out.")
-                except Exception:
-                    pass
+            # wait up to 20s for the turn to be used; if no action, auto-pass
+            try:
+                await asyncio.wait_for(game.turn_event.wait(), timeout=20)
+                acted = True
+            except asyncio.TimeoutError:
+                acted = False
+            finally:
+                game.turn_event.clear()
+
+            # check if player still alive (meta is the live record, updated in place by actions)
+            if current_uid not in game.players:
+                # left mid-turn: the recomputed accepted list already points at the next player,
+                # who still needs a prompt even though turn_index hasn't moved
+                game._last_prompt_turn = None
+                continue
+            if meta.get("hp", 0) <= 0:
+                # mark removed; the announcement goes out with the next player's prompt
+                meta["accepted"] = False
+                game._pending_announcements.append(f"<@{current_uid}> has fallen and is out.")
                 # do not increment turn_index relative to old accepted list --- recompute next
-                # simply continue to next loop which will pick next accepted player
+                # simply continue to next loop which will pick (and prompt) the next accepted player
+                game._last_prompt_turn = None
                 continue
 
-            # advance
-            game.turn_index = (game.turn_index + 1) % max(1, len(accepted))
+            # advance (an action already moved turn_index on; only a timed-out turn is passed here)
+            if not acted:
+                game.turn_index = (game.turn_index + 1) % max(1, len(accepted))
         game.state = "finished"
         try:
             await ch.send("The Haunted House session has ended. Thanks for playing!")
         except Exception:
             pass
-    except Exception as e:
-        print("Error in run_house_game:", e)
+    except Exception:
+        logging.exception("Error in run_house_game")
 
 try:
     bot.tree.add_command(house_group)
@@ -2662,8 +3264,19 @@ except Exception:
 
 @bot.event
 async def on_ready():
-    print(f"Logged in as {bot.user} (ID: {bot.user.id})")
-    print("------")
+    global _db_optimize_task, _main_loop, _discord_job_q, _schedule_cleanup_task
+    logging.info("Logged in as %s (ID: %s)", bot.user, bot.user.id)
+    _main_loop = asyncio.get_running_loop()
+    if _discord_job_q is None:
+        _discord_job_q = asyncio.Queue()
+        _discord_job_workers.extend(
+            asyncio.create_task(_discord_job_worker(), name=f"discord-job-{i}") for i in range(DISCORD_JOB_WORKERS)
+        )
+    # on_ready fires again after reconnects; only start the daily optimize once
+    if _db_optimize_task is None or _db_optimize_task.done():
+        _db_optimize_task = asyncio.create_task(run_coro_safe(_daily_db_optimize(), name="db-optimize"))
+    if _schedule_cleanup_task is None or _schedule_cleanup_task.done():
+        _schedule_cleanup_task = asyncio.create_task(run_coro_safe(_daily_schedule_cleanup(), name="schedule-cleanup"))
     # If we know the application id and desired permissions, print an invite URL for convenience
     try:
         app_id = getattr(bot, "application_id", None) or APPLICATION_ID
@@ -2672,46 +3285,48 @@ async def on_ready():
             app_str = str(app_id)
             perms = BOT_PERMISSIONS
             invite_url = f"https://discord.com/oauth2/authorize?client_id={app_str}&scope=bot%20applications.commands&permissions={perms}"
-            print(f"Invite URL: {invite_url}")
+            logging.info("Invite URL: %s", invite_url)
     except Exception:
         pass
     try:
         if GUILD_ID:
-            synced = await bot.tree.sync(guild=discord.Object(id=int(GUILD_ID)))
+            synced = await sync_with_backoff(guild=discord.Object(id=int(GUILD_ID)))
         else:
-            synced = await bot.tree.sync()
+            synced = await sync_with_backoff()
         try:
             names = [c.name for c in synced]
         except Exception:
             names = [getattr(c, 'name', str(c)) for c in synced]
-        print(f"Synced {len(synced)} commands: {names}")
-    except Exception as e:
-        print("Failed to sync commands:", e)
+        logging.info("Synced %d commands: %s", len(synced), names)
+    except Exception:
+        logging.exception("Failed to sync commands")
+
+# static part of the tournament lobby embed; only the timeout time is filled in per command
+_FURBY_TOURNAMENT_DESCRIPTION = (
+    "Tournament ID: furby-1234567890\n\n"
+    "Instructions:\n"
+    "• Click Join Tournament to enter your Furby\n"
+    "• Tournament will be divided by levels\n"
+    "• All Furbys will have max stats during battles\n"
+    "• The host can start the tournament when ready\n"
+    "• At least 2 Furbys of the same level are needed for that bracket\n"
+    "• Maximum 50 participants allowed\n\n"
+    "⚡ Revival System ⚡\n"
+    "• Eliminated Furbys may get a second chance!\n"
+    "• Revival checks occur at specific rounds\n"
+    "• There's a 60% chance of revival occurring\n"
+    "• Only a limited number of Furbys can be revived\n"
+    "• Each Furby can only be revived once per tournament\n\n"
+    "Lobby Timeout\n"
+    "Today at "
+)
 
 @bot.tree.command(name="furby_tournament", description="Create a Furby tournament embed")
 @app_commands.describe(title="Title for the tournament")
 async def furbytournament(interaction: discord.Interaction, title: str = "Furby Tournament"):
     host = interaction.user
     embed = discord.Embed(title=title, color=0xF5A623)
-    description = (
-        "Tournament ID: furby-1234567890\n\n"
-        "Instructions:\n"
-        "• Click Join Tournament to enter your Furby\n"
-        "• Tournament will be divided by levels\n"
-        "• All Furbys will have max stats during battles\n"
-        "• The host can start the tournament when ready\n"
-        "• At least 2 Furbys of the same level are needed for that bracket\n"
-        "• Maximum 50 participants allowed\n\n"
-        "⚡ Revival System ⚡\n"
-        "• Eliminated Furbys may get a second chance!\n"
-        "• Revival checks occur at specific rounds\n"
-        "• There's a 60% chance of revival occurring\n"
-        "• Only a limited number of Furbys can be revived\n"
-        "• Each Furby can only be revived once per tournament\n\n"
-        "Lobby Timeout\n"
-        "Today at "
-    )
-    embed.description = description + discord.utils.format_dt(discord.utils.utcnow(), style="t")
+    embed.description = _FURBY_TOURNAMENT_DESCRIPTION + discord.utils.format_dt(discord.utils.utcnow(), style="t")
     embed.set_footer(text=f"Host: {host.display_name}")
 
     view = TournamentView(host=host, timeout=None)
@@ -2720,27 +3335,66 @@ async def furbytournament(interaction: discord.Interaction, title: str = "Furby
     # interaction.response.send_message returns None when deferred; fetch the message
     # so instead we use followup to get the message object
     sent = await interaction.original_response()
-    tournaments[sent.id] = set()
-    # store metadata: host id, start timestamp, and max participants
-    tournaments_meta[sent.id] = {
-        "host": host.id,
-        "start": int(time.time()),
-        "max_participants": 50,
-    }
+    lobbies[sent.id] = Lobby(host=host.id, start=int(time.time()), max_participants=50, base_description=embed.description)
 
 
 def _current_date_str():
     return time.strftime("%Y-%m-%d", time.gmtime())
 
 
+@functools.lru_cache(maxsize=1)
+def _utc_midnight(day: str) -> int:
+    """Unix timestamp of 00:00 UTC on day (YYYY-MM-DD)."""
+    return calendar.timegm(time.strptime(day, "%Y-%m-%d"))
+
+
+# fixed SQL text for the schedule commands, reused from the shared connection's statement cache
+_SQL_CLEANUP_SCHEDULE = "DELETE FROM schedule_entries WHERE date < ?"
+_SQL_LIST_SCHEDULE = "SELECT slot, user_id, game FROM schedule_entries WHERE date = ? ORDER BY slot"
+_SQL_ADD_SCHEDULE = "INSERT OR IGNORE INTO schedule_entries(date, slot, user_id, game) VALUES (?, ?, ?, ?)"
+_SQL_DELETE_SCHEDULE = "DELETE FROM schedule_entries WHERE date = ? AND slot = ? AND user_id = ?"
+
 def _cleanup_old_schedule():
     """Remove schedule entries older than today (UTC-based daily reset)."""
-    today = _current_date_str()
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM schedule_entries WHERE date < ?", (today,))
-    conn.commit()
-    conn.close()
+    with db_cursor() as cur:
+        cur.execute(_SQL_CLEANUP_SCHEDULE, (_current_date_str(),))
+
+
+_schedule_cleanup_task: asyncio.Task | None = None
+
+
+async def _daily_schedule_cleanup():
+    """Clear out old signups at startup and then just after each UTC midnight. Commands only
+    ever read today's rows, so stale ones are never shown in between.
+    """
+    while True:
+        await run_db(_cleanup_old_schedule)
+        now = time.time()
+        await asyncio.sleep(86400 - now % 86400 + 1)
+
+
+def list_schedule(day: str) -> list[tuple[int, int, str]]:
+    """(slot, user_id, game) rows for day, ordered by slot."""
+    with db_cursor() as cur:
+        cur.execute(_SQL_LIST_SCHEDULE, (day,))
+        return cur.fetchall()
+
+
+def add_schedule_entry(day: str, slot: int, user_id: int, game: str):
+    with db_cursor() as cur:
+        cur.execute(_SQL_ADD_SCHEDULE, (day, slot, user_id, game))
+
+
+def delete_schedule_entry(day: str, slot: int, user_id: int) -> int:
+    """Returns the number of rows removed."""
+    with db_cursor() as cur:
+        cur.execute(_SQL_DELETE_SCHEDULE, (day, slot, user_id))
+        return cur.rowcount
+
+
+# bumped on every signup change; /schedule show reuses its last render while (date, version) match
+_schedule_version = 0
+_schedule_desc_cache: tuple[str, int, str] | None = None  # (date, version, description)
 
 
 schedule_group = app_commands.Group(name="schedule", description="Show or add schedule signups")
@@ -2748,39 +3402,37 @@ schedule_group = app_commands.Group(name="schedule", description="Show or add sc
 
 @schedule_group.command(name="show", description="Show today's schedule (24 slots)")
 async def show_schedule(interaction: discord.Interaction):
-    _cleanup_old_schedule()
+    global _schedule_desc_cache
     today = _current_date_str()
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT slot, user_id, game FROM schedule_entries WHERE date = ? ORDER BY slot", (today,))
-    rows = cur.fetchall()
-    conn.close()
-
-    # build a map slot -> list of entries
-    slots = {i: [] for i in range(24)}
-    for slot, user_id, game in rows:
-        slots.setdefault(slot, []).append((user_id, game))
-
-    # Build description with Discord timestamps: we will create a UTC timestamp for each slot (today at slot:00 UTC)
-    desc_lines = []
-    for hour in range(24):
-        # compute unix ts for today at hour:00 UTC (for user's local display)
-        struct = time.strptime(f"{today} {hour:02d}:00:00", "%Y-%m-%d %H:%M:%S")
-        ts = int(time.mktime(struct))
-        time_token = f"<t:{ts}:t>"
-        entries = slots.get(hour) or []
-        if entries:
-            entry_text = ", ".join([f"<@{uid}> ({game})" for uid, game in entries])
-        else:
-            entry_text = "(empty)"
-        # display slot number 1..24 on the left for simpler selection
-        slot_label = hour + 1
-        desc_lines.append(f"**{slot_label}** — {time_token} : {entry_text}")
+    version = _schedule_version
+    cached = _schedule_desc_cache
+    if cached is not None and cached[0] == today and cached[1] == version:
+        description = cached[2]
+    else:
+        rows = await run_db(list_schedule, today)
+        description = _render_schedule(today, rows)
+        # keyed on the version read before the query, so a signup racing it forces a rebuild
+        _schedule_desc_cache = (today, version, description)
 
-    embed = discord.Embed(title="Schedule (24h)", description="\n".join(desc_lines), color=0x00BFFF)
+    embed = discord.Embed(title="Schedule (24h)", description=description, color=0x00BFFF)
     await interaction.response.send_message(embed=embed, ephemeral=False)
 
 
+def _render_schedule(today: str, rows: list[tuple[int, int, str]]) -> str:
+    # slot -> "<@uid> (game), ..." for the slots that have signups
+    by_slot: dict[int, list[str]] = {}
+    for slot, user_id, game in rows:
+        by_slot.setdefault(slot, []).append(f"<@{user_id}> ({game})")
+
+    # One line per slot, numbered 1..24, with a Discord timestamp for slot:00 UTC today
+    # (rendered in each user's local time)
+    midnight = _utc_midnight(today)
+    return "\n".join(
+        f"**{hour + 1}** — <t:{midnight + hour * 3600}:t> : {', '.join(by_slot[hour]) if hour in by_slot else '(empty)'}"
+        for hour in range(24)
+    )
+
+
 @schedule_group.command(name="add", description="Add yourself to a numbered slot (1-24)")
 @app_commands.describe(slot="Slot number 1-24", game="Game or note to add")
 async def add_schedule(interaction: discord.Interaction, slot: int, game: str):
@@ -2792,17 +3444,13 @@ async def add_schedule(interaction: discord.Interaction, slot: int, game: str):
 
     # Use UTC date to store daily entries that reset every 24h at midnight UTC
     today = _current_date_str()
-    _cleanup_old_schedule()
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+    global _schedule_version
     # Upsert: allow multiple users per slot; prevent duplicate same user in same slot
     try:
-        cur.execute("INSERT OR IGNORE INTO schedule_entries(date, slot, user_id, game) VALUES (?, ?, ?, ?)", (today, time, interaction.user.id, game))
-        conn.commit()
-    except Exception as e:
-        print("DB error adding schedule:", e)
-    finally:
-        conn.close()
+        await run_db(add_schedule_entry, today, time, interaction.user.id, game)
+        _schedule_version += 1
+    except Exception:
+        logging.exception("DB error adding schedule")
 
     # show user the friendly slot number and the UTC hour
     display_slot = time + 1
@@ -2827,19 +3475,15 @@ async def delete_schedule(interaction: discord.Interaction, slot: int):
         return
     time_idx = slot - 1
 
+    global _schedule_version
     today = _current_date_str()
-    _cleanup_old_schedule()
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
     try:
-        cur.execute("DELETE FROM schedule_entries WHERE date = ? AND slot = ? AND user_id = ?", (today, time_idx, interaction.user.id))
-        deleted = cur.rowcount
-        conn.commit()
-    except Exception as e:
-        print("DB error deleting schedule:", e)
+        deleted = await run_db(delete_schedule_entry, today, time_idx, interaction.user.id)
+        if deleted:
+            _schedule_version += 1
+    except Exception:
+        logging.exception("DB error deleting schedule")
         deleted = 0
-    finally:
-        conn.close()
 
     if deleted:
         await interaction.response.send_message(f"Removed your signup from slot {slot} ({time_idx:02d}:00 UTC). Use `/schedule show` to view.", ephemeral=True)
@@ -2847,6 +3491,12 @@ async def delete_schedule(interaction: discord.Interaction, slot: int):
         await interaction.response.send_message(f"No signup found for you in slot {slot}. Use `/schedule show` to check current signups.", ephemeral=True)
 
 
+# guild syncs are rate limited; refuse a manual resync this soon after the last one in a guild
+RESYNC_COOLDOWN = 60  # seconds
+# guild_id -> monotonic time of the last manual resync
+_last_resync: dict[int, float] = {}
+
+
 @bot.tree.command(name="resync_commands", description="Force re-sync of commands in this guild (admins only)")
 @app_commands.checks.has_permissions(manage_guild=True)
 async def resync_commands(interaction: discord.Interaction):
@@ -2854,19 +3504,29 @@ async def resync_commands(interaction: discord.Interaction):
     if not interaction.guild:
         await interaction.response.send_message("This command must be used in a guild.", ephemeral=True)
         return
+    gid = interaction.guild.id
+    now = time.monotonic()
+    last = _last_resync.get(gid)
+    if last is not None and now - last < RESYNC_COOLDOWN:
+        await interaction.response.send_message(f"Commands were synced {int(now - last)}s ago; wait a minute before retrying.", ephemeral=True)
+        return
+    # claimed up front so a second click while this one runs is refused too
+    _last_resync[gid] = now
+    # a rate-limited sync can back off for longer than the interaction's 3s reply window
+    await interaction.response.defer(ephemeral=True)
     try:
-        synced = await bot.tree.sync(guild=discord.Object(id=interaction.guild.id))
-        await interaction.response.send_message(f"Synced {len(synced)} commands in this guild.", ephemeral=True)
-        print(f"Manual resync in guild {interaction.guild.id}: {[c.name for c in synced]}")
+        synced = await sync_with_backoff(guild=discord.Object(id=gid))
+        await interaction.followup.send(f"Synced {len(synced)} commands in this guild.", ephemeral=True)
+        logging.info("Manual resync in guild %s: %s", gid, [c.name for c in synced])
     except Exception as e:
-        await interaction.response.send_message(f"Resync failed: {e}", ephemeral=True)
+        # a failed sync shouldn't lock the admin out of retrying
+        _last_resync.pop(gid, None)
+        await interaction.followup.send(f"Resync failed: {e}", ephemeral=True)
 
 # ...existing code...
 
 if __name__ == "__main__":
     # Try to run the bot, but if the token is invalid prompt up to 3 times to re-enter
-    import discord as _discord
-
     max_attempts = 3
     attempts = 0
     while attempts < max_attempts:
@@ -2880,34 +3540,14 @@ if __name__ == "__main__":
                 print("No token entered. Exiting.")
                 raise SystemExit(1)
             TOKEN = entered.strip()
-            # persist to .env
-            env_path = os.path.join(os.path.dirname(__file__), ".env")
-            lines = []
-            if os.path.exists(env_path):
-                try:
-                    with open(env_path, "r") as f:
-                        lines = f.readlines()
-                except Exception:
-                    lines = []
-            updated = False
-            for i, line in enumerate(lines):
-                if line.strip().startswith("DISCORD_TOKEN="):
-                    lines[i] = f"DISCORD_TOKEN={TOKEN}\n"
-                    updated = True
-                    break
-            if not updated:
-                lines.append(f"DISCORD_TOKEN={TOKEN}\n")
-            try:
-                with open(env_path, "w") as f:
-                    f.writelines(lines)
-                print(f"Saved token to {env_path}.")
-            except Exception as e:
-                print("Failed to save .env file:", e)
+            save_token_to_env(TOKEN)
 
         try:
-            bot.run(TOKEN)
+            # log_handler=None: discord.py's records propagate to the queued root handler above
+            bot.run(TOKEN, log_handler=None)
+            optimize_db()
             break
-        except _discord.errors.LoginFailure:
+        except discord.errors.LoginFailure:
             attempts += 1
             print(f"Login failed (invalid token). Attempts left: {max_attempts - attempts}")
             # Clear TOKEN to force re-prompt